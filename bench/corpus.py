@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import copy
+import random
+import argparse
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import utils
+
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+INFRAS = [
+  # (machines.json infrastructure, counts key, writeup infra, writeup category, path prefix)
+  ("htb", "htb", "HackTheBox", "hackthebox", "htb"),
+  ("vulnhub", "vh", "VulnHub", "vulnhub", "vh"),
+  ("thm", "thm", "TryHackMe", "tryhackme", "thm"),
+]
+
+SERVICES = [
+  ("21", "tcp", "ftp", ["vsftpd 2.3.4", "ProFTPD 1.3.5", "Microsoft ftpd"]),
+  ("22", "tcp", "ssh", ["OpenSSH 7.6p1 Ubuntu 4ubuntu0.3", "OpenSSH 8.2p1", "OpenSSH 7.4"]),
+  ("25", "tcp", "smtp", ["Postfix smtpd", "Exim smtpd 4.92"]),
+  ("53", "udp", "domain", ["ISC BIND 9.11.3", "Simple DNS Plus"]),
+  ("80", "tcp", "http", ["Apache httpd 2.4.29", "nginx 1.14.0", "Microsoft IIS httpd 10.0"]),
+  ("88", "tcp", "kerberos-sec", ["Microsoft Windows Kerberos"]),
+  ("110", "tcp", "pop3", ["Dovecot pop3d"]),
+  ("139", "tcp", "netbios-ssn", ["Samba smbd 3.X - 4.X", "Microsoft Windows netbios-ssn"]),
+  ("161", "udp", "snmp", ["SNMPv1 server; net-snmp SNMPv3 server"]),
+  ("389", "tcp", "ldap", ["Microsoft Windows Active Directory LDAP"]),
+  ("443", "tcp", "https", ["Apache httpd 2.4.41", "nginx 1.18.0"]),
+  ("445", "tcp", "microsoft-ds", ["Windows Server 2016 Standard 14393 microsoft-ds", "Samba smbd 4.7.6-Ubuntu"]),
+  ("1433", "tcp", "ms-sql-s", ["Microsoft SQL Server 2017"]),
+  ("2049", "tcp", "nfs", ["2-4 (RPC #100003)"]),
+  ("3306", "tcp", "mysql", ["MySQL 5.7.29", "MariaDB 10.3.23"]),
+  ("3389", "tcp", "ms-wbt-server", ["Microsoft Terminal Services"]),
+  ("5985", "tcp", "http", ["Microsoft HTTPAPI httpd 2.0"]),
+  ("6379", "tcp", "redis", ["Redis key-value store 4.0.9"]),
+  ("8080", "tcp", "http-proxy", ["Apache Tomcat 8.5.5", "Jetty 9.4.z-SNAPSHOT"]),
+  ("27017", "tcp", "mongodb", ["MongoDB 3.6.3"]),
+]
+
+TECHNIQUES = {
+  "enumerate": ["nmap", "autorecon", "gobuster", "nikto", "wpscan", "enum4linux", "smbclient", "smbmap", "snmpwalk", "ldapsearch", "dirsearch", "ffuf", "showmount", "redis_cli", "mongo_cli", "kerbrute", "searchsploit", "source_code_review", "burpsuite", "whatweb"],
+  "exploit": ["sqli", "lfi", "rfi", "rce", "file_upload", "ssti", "xxe", "deserialization", "command_injection", "default_credentials", "password_reuse", "bruteforce_hydra", "phpmyadmin", "tomcat_manager", "eternalblue", "shellshock", "wordpress_plugin", "kerberoasting", "asreproasting", "ssrf"],
+  "privesc": ["sudo", "suid", "kernel_exploit", "cron", "writable_passwd", "docker_group", "lxd_group", "path_hijack", "capabilities", "nfs_no_root_squash", "seimpersonate", "juicypotato", "unquoted_service_path", "alwaysinstallelevated", "dll_hijack", "mysql_udf", "tmux_session", "logrotate", "pspy", "linpeas"],
+}
+
+EXTRATAGS = ["wordpress", "joomla", "drupal", "apache", "nginx", "iis", "tomcat", "php", "python", "nodejs", "java", "mysql", "mssql", "postgresql", "redis", "mongodb", "smb", "ftp", "ssh", "ldap", "kerberos", "activedirectory", "docker", "git", "cms", "api"]
+
+CREDTYPES = ["ssh", "ftp", "wordpress", "mysql", "smb", "web", "rdp"]
+USERNAMES = ["root", "admin", "administrator", "www-data", "john", "alice", "bob", "svc_backup", "guest", "mark", "jenkins", "tomcat"]
+
+
+def ttp_vocabulary():
+  return {phase: ["%s_%s" % (phase, x) for x in TECHNIQUES[phase]] for phase in TECHNIQUES}
+
+
+def gen_meta(rng):
+  # meta.yml: ttp descriptions with the ports they apply to, tips, tools and the methodology used by --summarize
+  ports = ["%s/%s" % (port, l4) for port, l4, proto, products in SERVICES]
+  meta = {"ttps": {}, "tips": [], "tools": [], "methodology": {}}
+  for phase, ttps in ttp_vocabulary().items():
+    meta["ttps"][phase] = {}
+    for ttp in ttps:
+      meta["ttps"][phase][ttp] = {
+        "description": "Use %s during the %s phase." % (ttp.split("_", 1)[1].replace("_", " "), phase),
+        "cli": "%s -h" % (ttp.split("_", 1)[1]),
+        "references": ["https://example.com/%s" % (ttp)] if rng.random() < 0.7 else [None],
+        "ports": rng.sample(ports, rng.randint(0, 3)),
+      }
+  for idx in range(20):
+    meta["tips"].append({"description": "Tip #%d" % (idx), "cli": "echo tip%d" % (idx)})
+    meta["tools"].append({"description": "Tool #%d" % (idx), "cli": "tool%d --help" % (idx)})
+  for phase in ["recon", "enumerate", "exploit", "privesc"]:
+    meta["methodology"][phase] = {"goal": "Goal for %s" % (phase), "process": ["Step %d of %s" % (x, phase) for x in range(5)]}
+  return {"meta": meta}
+
+
+def gen_counts(machines):
+  # the same keys a real machines.json carries: totals, owned counts and percentages per infra/os/oscplike group
+  groups = {"total": lambda m: True, "nix": lambda m: m["os"] != "Windows", "windows": lambda m: m["os"] == "Windows", "oscplike": lambda m: m["oscplike"]}
+  for infra, short, name, category, prefix in INFRAS:
+    groups[short] = lambda m, infra=infra: m["infrastructure"] == infra
+    groups["%snix" % (short)] = lambda m, infra=infra: m["infrastructure"] == infra and m["os"] != "Windows"
+    groups["%swindows" % (short)] = lambda m, infra=infra: m["infrastructure"] == infra and m["os"] == "Windows"
+    groups["%soscplike" % (short)] = lambda m, infra=infra: m["infrastructure"] == infra and m["oscplike"]
+  groups["oscplikenix"] = lambda m: m["oscplike"] and m["os"] != "Windows"
+  groups["oscplikewindows"] = lambda m: m["oscplike"] and m["os"] == "Windows"
+
+  counts = {}
+  for group, match in groups.items():
+    total = len([m for m in machines if match(m)])
+    owned = len([m for m in machines if match(m) and (m["owned_user"] or m["owned_root"])])
+    counts["total%s" % (group) if group in ["total", "nix", "windows", "oscplike", "htb", "vh", "thm"] else group] = total
+    counts["owned%s" % (group)] = owned
+    counts["per%s" % (group)] = (owned * 100.0 / total) if total else 0.0
+  counts["total"] = counts["totaltotal"]
+  return counts
+
+
+def gen_machines(count, owned, rng):
+  machines = []
+  for idx in range(count):
+    infra, short, name, category, prefix = INFRAS[idx % len(INFRAS)]
+    shortname = "box%05d" % (idx)
+    difficulty = rng.choice(["Easy", "Medium", "Hard", "Insane"])
+    machines.append({
+      "id": idx + 1,
+      "name": "Box%05d" % (idx),
+      "shortname": shortname,
+      "url": "https://%s.example.com/machines/%s" % (infra, shortname),
+      "os": rng.choice(["Linux", "Linux", "Windows", "FreeBSD"]),
+      "points": rng.choice([20, 30, 40, 50]),
+      "oscplike": rng.random() < 0.25,
+      "infrastructure": infra,
+      "verbose_id": "%s#%s" % (infra, shortname),
+      "difficulty": difficulty.lower(),
+      "difficulty_ratings": [rng.randint(0, 200) for _ in range(10)],
+      "matrix": {"aggregate": [round(rng.uniform(0, 10), 1) for _ in range(5)], "maker": [round(rng.uniform(0, 10), 1) for _ in range(5)]},
+      "owned_user": idx < owned,
+      "owned_root": idx < owned and rng.random() < 0.9,
+      "release": "20%02d-%02d-%02d" % (rng.randint(17, 23), rng.randint(1, 12), rng.randint(1, 28)),
+      "avatar": "https://%s.example.com/avatars/%s.png" % (infra, shortname),
+      "user_owns": rng.randint(0, 20000),
+      "root_owns": rng.randint(0, 20000),
+    })
+  return {"counts": gen_counts(machines), "machines": machines}
+
+
+def gen_killchain(root, tags, rng):
+  # root -> enumerate -> exploit -> privesc, with a few alternative branches like real killchains
+  byphase = {phase: [x for x in tags if x.startswith("%s_" % (phase))] for phase in ["enumerate", "exploit", "privesc"]}
+  branches = []
+  for enumerate_ttp in (byphase["enumerate"] or ["enumerate_nmap"])[:rng.randint(1, 3)]:
+    exploits = []
+    for exploit_ttp in (byphase["exploit"] or ["exploit_rce"])[:rng.randint(1, 2)]:
+      privescs = [{"... %s" % (x): None} for x in (byphase["privesc"] or ["privesc_sudo"])[:rng.randint(1, 2)]]
+      exploits.append({".. %s" % (exploit_ttp): privescs})
+    branches.append({". %s" % (enumerate_ttp): exploits})
+  return [{root: branches}]
+
+
+def gen_steps(template, prefix, count, rng):
+  steps = []
+  for idx in range(count):
+    step = copy.deepcopy(template[idx % len(template)])
+    step["description"] = "%s step %d: %s\n" % (prefix, idx, " ".join(rng.choice(["found", "the", "service", "version", "exposes", "a", "vulnerable", "endpoint", "which", "allows", "us", "to", "read", "files"]) for _ in range(rng.randint(8, 30))))
+    step["command"] = "$ %s\n%s\n" % (rng.choice(["nmap -sC -sV -p- target", "curl -s http://target/", "gobuster dir -u http://target -w common.txt", "sudo -l", "find / -perm -4000 2>/dev/null", "python3 exploit.py target"]), "\n".join("output line %d" % (x) for x in range(rng.randint(2, 25))))
+    step["screenshot"] = ["./%s%02d.png" % (prefix, idx)] if rng.random() < 0.6 else None
+    steps.append(step)
+  return steps
+
+
+def gen_writeup(machine, template, vocabulary, rng, private=False):
+  infra = [x for x in INFRAS if x[0] == machine["infrastructure"]][0]
+  path = "%s.%s" % (infra[4], machine["shortname"])
+  tags = []
+  for phase in ["enumerate", "exploit", "privesc"]:
+    tags.extend(rng.sample(vocabulary[phase], rng.randint(1, 4)))
+  tags.extend(rng.sample(EXTRATAGS, rng.randint(0, 4)))
+  ttptags = [x for x in tags if "_" in x]
+
+  writeup = copy.deepcopy(template)
+  metadata = writeup["writeup"]["metadata"]
+  metadata["status"] = "private" if private else "public"
+  metadata["datetime"] = int("20%02d%02d%02d" % (rng.randint(18, 23), rng.randint(1, 12), rng.randint(1, 28)))
+  metadata["infra"] = infra[2]
+  metadata["name"] = machine["name"]
+  metadata["points"] = machine["points"]
+  metadata["path"] = path
+  metadata["url"] = machine["url"]
+  metadata["references"] = ["https://example.com/%s/ref%d" % (machine["shortname"], x) for x in range(rng.randint(0, 3))] or [None]
+  metadata["categories"] = [infra[3], machine["os"].lower()] + (["oscp"] if machine["oscplike"] else [])
+  metadata["tags"] = tags
+
+  overview = writeup["writeup"]["overview"]
+  overview["description"] = "This is a writeup for %s VM [%s](%s).\n" % (infra[2], machine["name"], machine["url"])
+  overview["killchain"] = gen_killchain("_ [%s] %s/10.10.%d.%d" % (infra[2], machine["name"], rng.randint(0, 255), rng.randint(1, 254)), ttptags, rng)
+  overview["ttps"] = {}
+  for port, l4, proto, products in rng.sample(SERVICES, rng.randint(1, 5)):
+    protokey = rng.choice(["%s/%s" % (port, l4), "%s/%s/%s" % (port, l4, proto), "%s/%s/%s/%s" % (port, l4, proto, rng.choice(products))])
+    overview["ttps"][protokey] = " ".join(rng.sample(ttptags, min(len(ttptags), rng.randint(1, 4))))
+
+  enumeration = writeup["writeup"]["enumeration"]
+  enumeration["steps"] = gen_steps(enumeration["steps"], "enumerate", rng.randint(3, 10), rng)
+  enumeration["findings"] = {
+    "openports": ["%s/%s" % (port, l4) for port, l4, proto, products in rng.sample(SERVICES, rng.randint(1, 6))],
+    "files": ["/var/www/html/file%d.php" % (x) for x in range(rng.randint(0, 4))] or [None],
+    "users": {credtype: rng.sample(USERNAMES, rng.randint(1, 3)) for credtype in rng.sample(CREDTYPES, rng.randint(1, 3))},
+  }
+  for section in ["exploitation", "privesc"]:
+    writeup["writeup"][section]["steps"] = gen_steps(writeup["writeup"][section]["steps"], section, rng.randint(2, 8), rng)
+    writeup["writeup"][section]["vuln"] = [{"cve": "CVE-20%02d-%04d" % (rng.randint(10, 23), rng.randint(1, 9999)) if rng.random() < 0.5 else None, "edb": rng.randint(10000, 50000) if rng.random() < 0.3 else None, "links": ["https://example.com/vuln%d" % (rng.randint(0, 999))]}]
+
+  writeup["writeup"]["postexploit"] = {
+    "user": rng.choice(USERNAMES),
+    "hostname": machine["shortname"],
+    "id": "uid=0(root) gid=0(root) groups=0(root)\n",
+    "uname": "Linux %s 4.15.0-20-generic #21-Ubuntu SMP x86_64 GNU/Linux\n" % (machine["shortname"]),
+    "ifconfig": "eth0: inet 10.10.10.%d netmask 255.255.255.0\n" % (rng.randint(1, 254)),
+    "users": rng.sample(USERNAMES, rng.randint(1, 4)),
+  }
+  # a shared pool of passwords and hashes so loot is reused across writeups, like real password reuse
+  writeup["writeup"]["loot"] = {
+    "hashes": ["%032x" % (rng.randint(0, 500)) for _ in range(rng.randint(0, 4))] or [None],
+    "credentials": {credtype: ["%s/Passw0rd%d!" % (rng.choice(USERNAMES), rng.randint(0, 300)) if rng.random() < 0.8 else "token%d" % (rng.randint(0, 300)) for _ in range(rng.randint(1, 3))] for credtype in rng.sample(CREDTYPES, rng.randint(1, 3))},
+    "flags": ["%032x" % (rng.getrandbits(128)), "%032x" % (rng.getrandbits(128))],
+  }
+  writeup["writeup"]["learning"] = ["Learned %s" % (x) for x in ttptags[:rng.randint(1, 4)]]
+  return path, writeup
+
+
+def write_writeup(writeupdir, path, writeup):
+  destdir = "%s/%s" % (writeupdir, path)
+  utils.mkdirp(destdir)
+  with open("%s/writeup.yml" % (destdir), "w") as fp:
+    yaml.dump(writeup, fp, Dumper=utils.YAMLDumper, default_flow_style=False, sort_keys=False, allow_unicode=True)
+  # referenced images only need to exist, their content is hashed but never decoded
+  for ref in utils.file_refs(writeup):
+    filename = "%s/%s" % (destdir, ref)
+    if not os.path.isfile(filename):
+      with open(filename, "wb") as fp:
+        fp.write(b"\x89PNG\r\n\x1a\n" + os.urandom(64))
+
+
+def generate(home, writeups, machines=None, seed=1337, privateratio=0.1):
+  # $HOME layout svachal expects: toolbox/bootstrap/machines.json and toolbox/projects/writeups/<infra>.<name>/writeup.yml
+  rng = random.Random(seed)
+  machines = machines if machines else max(writeups * 5, 50)
+  if machines < writeups:
+    raise ValueError("need at least as many machines (%d) as writeups (%d)" % (machines, writeups))
+  writeupdir = "%s/toolbox/projects/writeups" % (home)
+  utils.mkdirp("%s/toolbox/bootstrap" % (home))
+  utils.mkdirp(writeupdir)
+
+  machinesstats = gen_machines(machines, writeups, rng)
+  utils.save_json(machinesstats, "%s/toolbox/bootstrap/machines.json" % (home))
+  with open("%s/meta.yml" % (writeupdir), "w") as fp:
+    yaml.dump(gen_meta(rng), fp, Dumper=utils.YAMLDumper, default_flow_style=False, sort_keys=False)
+
+  template = utils.load_yaml("%s/template.writeup.yml" % (BASEDIR))
+  vocabulary = ttp_vocabulary()
+  for idx in range(writeups):
+    path, writeup = gen_writeup(machinesstats["machines"][idx], template, vocabulary, rng, private=rng.random() < privateratio)
+    write_writeup(writeupdir, path, writeup)
+  return writeupdir
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="generate a synthetic writeup corpus and machines.json for benchmarking svachal")
+  parser.add_argument('home', action='store', help='directory to use as $HOME for svachal (created if missing)')
+  parser.add_argument('-n', '--writeups', required=False, action='store', type=int, default=100, help='synthetic writeups (default: 100)')
+  parser.add_argument('-m', '--machines', required=False, action='store', type=int, default=None, help='machines in machines.json (default: 5x writeups, at least 50)')
+  parser.add_argument('-s', '--seed', required=False, action='store', type=int, default=1337, help='corpus seed (default: 1337)')
+  parser.add_argument('-p', '--private', required=False, action='store', type=float, default=0.1, help='ratio of private writeups (default: 0.1)')
+  args = parser.parse_args()
+
+  writeupdir = generate(os.path.abspath(args.home), args.writeups, machines=args.machines, seed=args.seed, privateratio=args.private)
+  utils.info("generated %d writeups @ %s" % (args.writeups, writeupdir))
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import utils
+import corpus
+
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+REPOURL = "https://github.com/user/writeups"
+
+# pandoc/dot stand-ins: they only create the output files svachal expects, so timings measure svachal itself
+STUBS = {
+  "pandoc": """#!%s
+import sys
+args = sys.argv[1:]
+out = args[args.index("-o")+1]
+if out.endswith(".tex"):
+  open(out, "w").write("\\\\documentclass{article}\\n\\\\begin{document}\\nstub\\n\\\\end{document}\\n")
+else:
+  open(out, "wb").write(b"%%PDF-1.5 stub")
+""",
+  "dot": """#!%s
+import sys
+args = sys.argv[1:]
+outs = [args[args.index("-o")+1]] if "-o" in args else []
+if "-O" in args:
+  outs.extend(["%%s.png" %% (x) for x in args if not x.startswith("-")])
+for out in outs:
+  open(out, "wb").write(b"\\x89PNG stub")
+""",
+}
+
+STEPS = ["start", "manual", "rebuildall_cold", "rebuildall_warm", "finish", "summarize_cold", "summarize_warm", "graph", "query_cold", "query_warm", "loot"]
+
+
+def install_stubs(bindir):
+  utils.mkdirp(bindir)
+  for name, source in STUBS.items():
+    filename = "%s/%s" % (bindir, name)
+    with open(filename, "w") as fp:
+      fp.write(source % (sys.executable))
+    os.chmod(filename, 0o755)
+
+
+def remove(*filenames):
+  for filename in filenames:
+    if os.path.isfile(filename):
+      os.remove(filename)
+
+
+def clean_outputs(writeupdir):
+  # everything --rebuildall produces, so a cold rebuild re-renders markdown, killchains and pdfs
+  shutil.rmtree("%s/.svachal" % (writeupdir), ignore_errors=True)
+  for entry in os.scandir(writeupdir):
+    if entry.is_dir() and not entry.name.startswith("."):
+      remove(*["%s/%s" % (entry.path, name) for name in ["writeup.md", "writeup.pdf", "killchain.dot", "killchain.png"]])
+
+
+def steps_for(home, writeupdir, machines, writeups, jobs):
+  # name -> (svachal arguments, cwd, prepare callback run untimed before every measured run)
+  svachal = [sys.executable, "%s/svachal.py" % (BASEDIR), "-w", writeupdir, "-g", REPOURL]
+  newmachine = machines["machines"][writeups]
+  newpath = "%s/%s.%s" % (writeupdir, [x[4] for x in corpus.INFRAS if x[0] == newmachine["infrastructure"]][0], newmachine["shortname"])
+  public = sorted(entry.path for entry in os.scandir(writeupdir) if entry.is_dir() and os.path.isfile("%s/writeup.yml" % (entry.path)) and "status: public" in open("%s/writeup.yml" % (entry.path)).read())
+  return {
+    "start": (svachal + ["-s", newmachine["url"]], home, lambda: shutil.rmtree(newpath, ignore_errors=True)),
+    "manual": (svachal + ["-m", "htb.benchmark"], home, lambda: shutil.rmtree("%s/htb.benchmark" % (writeupdir), ignore_errors=True)),
+    "rebuildall_cold": (svachal + ["-r", "-j", str(jobs)], home, lambda: clean_outputs(writeupdir)),
+    "rebuildall_warm": (svachal + ["-r", "-j", str(jobs)], home, None),
+    "finish": (svachal + ["-f"], public[0], None),
+    "summarize_cold": (svachal + ["-z"], home, lambda: remove("%s/.svachal/summarize.json" % (writeupdir))),
+    "summarize_warm": (svachal + ["-z"], home, None),
+    "graph": (svachal + ["--graph", "-j", str(jobs)], home, None),
+    "query_cold": (svachal + ["-q", "os=linux", "--json"], home, lambda: remove(*["%s/.svachal/catalog.db%s" % (writeupdir, x) for x in ["", "-wal", "-shm"]])),
+    "query_warm": (svachal + ["-q", "os=linux", "--json"], home, None),
+    "loot": (svachal + ["-l", "root"], home, None),
+  }, [newpath, "%s/htb.benchmark" % (writeupdir)]
+
+
+def timeit(cmd, cwd, env, prepare, runs):
+  timings = []
+  for _ in range(runs):
+    if prepare:
+      prepare()
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    timings.append(time.perf_counter() - start)
+  timings = sorted(timings)
+  return {"min": timings[0], "median": timings[len(timings)//2], "max": timings[-1]}
+
+
+def bench_scale(tmpdir, writeups, machines, steps, runs, jobs, seed, env):
+  home = "%s/home-%d" % (tmpdir, writeups)
+  start = time.perf_counter()
+  writeupdir = corpus.generate(home, writeups, machines=machines, seed=seed)
+  generated = time.perf_counter() - start
+  machinesstats = utils.load_json("%s/toolbox/bootstrap/machines.json" % (home))
+  env = dict(env, HOME=home)
+
+  commands, scratch = steps_for(home, writeupdir, machinesstats, writeups, jobs)
+  results = {}
+  try:
+    for name in steps:
+      cmd, cwd, prepare = commands[name]
+      results[name] = timeit(cmd, cwd, env, prepare, runs)
+      # writeups created by --start/--manual are removed so later steps see the generated corpus only
+      for dirpath in scratch:
+        shutil.rmtree(dirpath, ignore_errors=True)
+  finally:
+    shutil.rmtree(home, ignore_errors=True)
+  return {"writeups": writeups, "machines": len(machinesstats["machines"]), "corpus": generated, "steps": results}
+
+
+def git_commit():
+  try:
+    return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BASEDIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+  except:
+    return None
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="time svachal opcodes on synthetic writeup corpora of increasing size")
+  parser.add_argument('-n', '--scales', required=False, action='store', default="10,50,200", help='comma separated corpus sizes in writeups (default: 10,50,200)')
+  parser.add_argument('-m', '--machines', required=False, action='store', type=int, default=None, help='machines in machines.json (default: 5x writeups, at least 50)')
+  parser.add_argument('-r', '--runs', required=False, action='store', type=int, default=3, help='runs per step (default: 3)')
+  parser.add_argument('-j', '--jobs', required=False, action='store', type=int, default=1, help='--jobs passed to rebuildall and graph (default: 1)')
+  parser.add_argument('-s', '--seed', required=False, action='store', type=int, default=1337, help='corpus seed (default: 1337)')
+  parser.add_argument('--steps', required=False, action='store', default=",".join(STEPS), help='comma separated steps to run (default: all of %s)' % (",".join(STEPS)))
+  parser.add_argument('--real', required=False, action='store_true', help='use the installed pandoc/dot instead of stubs')
+  parser.add_argument('-o', '--output', required=False, action='store', help='also write results as json to this file')
+  parser.add_argument('--json', required=False, action='store_true', help='print results as json')
+  args = parser.parse_args()
+
+  steps = [x.strip() for x in args.steps.split(",") if x.strip()]
+  unknown = [x for x in steps if x not in STEPS]
+  if unknown:
+    parser.error("unknown steps: %s (expected: %s)" % (", ".join(unknown), ", ".join(STEPS)))
+
+  tmpdir = tempfile.mkdtemp(prefix="svachal-bench-")
+  env = dict(os.environ)
+  if not args.real:
+    install_stubs("%s/bin" % (tmpdir))
+    env["PATH"] = "%s/bin%s%s" % (tmpdir, os.pathsep, env.get("PATH", ""))
+
+  results = {
+    "commit": git_commit(),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "stubbed": not args.real,
+    "runs": args.runs,
+    "jobs": args.jobs,
+    "scales": [],
+  }
+  try:
+    for writeups in [int(x) for x in args.scales.split(",") if x.strip()]:
+      results["scales"].append(bench_scale(tmpdir, writeups, args.machines, steps, args.runs, args.jobs, args.seed, env))
+      if not args.json:
+        scale = results["scales"][-1]
+        print("%d writeups, %d machines (corpus generated in %.1fs)" % (scale["writeups"], scale["machines"], scale["corpus"]))
+        for name in steps:
+          print("  %-16s min %9.1fms  median %9.1fms  max %9.1fms" % (name, scale["steps"][name]["min"]*1000, scale["steps"][name]["median"]*1000, scale["steps"][name]["max"]*1000))
+  finally:
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+  if args.output:
+    with open(args.output, "w") as fp:
+      json.dump(results, fp, indent=2, sort_keys=True)
+  if args.json:
+    print(json.dumps(results, indent=2, sort_keys=True))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def timeit(cmd, env, cwd, prepare, runs):
+  timings = []
+  for _ in range(runs):
+    if prepare:
+      prepare()
+    start = time.perf_counter()
+    subprocess.run(cmd, env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    timings.append(time.perf_counter() - start)
+  return timings
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="measure svachal cli startup time against a budget")
+  parser.add_argument('-n', '--runs', required=False, action='store', type=int, default=10, help='runs per command (default: 10)')
+  parser.add_argument('-b', '--budget', required=False, action='store', type=float, default=0.2, help='max median wall time per command in seconds (default: 0.2)')
+  parser.add_argument('--json', required=False, action='store_true', help='print results as json')
+  args = parser.parse_args()
+
+  # an empty $HOME without machines.json: the interactive commands below must not need to parse it
+  tmpdir = tempfile.mkdtemp(prefix="svachal-bench-")
+  env = dict(os.environ, HOME=tmpdir)
+  svachal = [sys.executable, "%s/svachal.py" % (BASEDIR), "-w", tmpdir, "-g", "https://github.com/user/writeups"]
+  # name -> (command, prepare callback run untimed before every measured run)
+  commands = {
+    "interpreter": ([sys.executable, "-c", "pass"], None),
+    "help": ([sys.executable, "%s/svachal.py" % (BASEDIR), "-h"], None),
+    # --manual only creates a writeup that does not exist yet, so every run starts without it
+    "manual": (svachal + ["-m", "htb.benchmark"], lambda: shutil.rmtree("%s/htb.benchmark" % (tmpdir), ignore_errors=True)),
+  }
+
+  results = {}
+  try:
+    for name, (cmd, prepare) in commands.items():
+      timings = sorted(timeit(cmd, env, tmpdir, prepare, args.runs))
+      results[name] = {"min": timings[0], "median": timings[len(timings)//2], "max": timings[-1]}
+  finally:
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+  failed = [name for name in results if name != "interpreter" and results[name]["median"] > args.budget]
+  if args.json:
+    print(json.dumps({"budget": args.budget, "results": results, "failed": failed}, indent=2, sort_keys=True))
+  else:
+    for name in results:
+      print("%-12s min %6.1fms  median %6.1fms  max %6.1fms%s" % (name, results[name]["min"]*1000, results[name]["median"]*1000, results[name]["max"]*1000, "  (over budget)" if name in failed else ""))
+  sys.exit(1 if failed else 0)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import utils
+import svachal
+import corpus
+
+
+PHASES = ["enumerate", "exploit", "privesc"]
+REPOURL = "https://github.com/user/writeups"
+
+
+def writeup_entries(svl, factslist):
+  # (facts, writeups entry) for every public writeup, the entry is what merge_writeup_facts() passes to merge_writeup_ttps()
+  entries = []
+  for facts in factslist:
+    if facts["private"]:
+      continue
+    metadata = facts["metadata"]
+    machine = svl.machine_lookup(url=metadata["url"]) or {}
+    verbose_id = machine.get("verbose_id") or "%s#%s" % (metadata["infra"].lower().strip(), metadata["name"].replace(" ", "").lower().strip())
+    entries.append((facts, {"name": metadata["name"], "verbose_id": verbose_id, "url": "%s/blob/master/%s/writeup.pdf" % (REPOURL, metadata["path"])}))
+  return entries
+
+
+def aggregate_legacy(entries, techniques):
+  # the previous algorithm: dedupe and sort per port per writeup, linear membership checks for ttps
+  ttpsitw = {}
+  for facts, writeup in entries:
+    for port, l4, protokey, ttplist in facts["ttpsitw"]:
+      if port not in ttpsitw:
+        ttpsitw[port] = {"port": port, "l4": l4, "ttps": [], "ttpsitw": list(ttplist), "protokeys": [protokey] if protokey else [], "writeups": [writeup]}
+      else:
+        ttpsitw[port]["ttpsitw"].extend(ttplist)
+        if protokey:
+          ttpsitw[port]["protokeys"].append(protokey)
+        ttpsitw[port]["writeups"].append(writeup)
+      ttpsitw[port]["ttpsitw"] = sorted(list(set(ttpsitw[port]["ttpsitw"])), key=str.casefold)
+      ttpsitw[port]["protokeys"] = sorted(list(set(ttpsitw[port]["protokeys"])), key=str.casefold)
+  for phase in PHASES:
+    for ttp in techniques[phase]:
+      for port in techniques[phase][ttp].get("ports") or []:
+        if not port:
+          continue
+        port, l4 = port.split("/")
+        if port not in ttpsitw:
+          ttpsitw[port] = {"port": port, "l4": l4, "ttps": [ttp], "ttpsitw": [], "protokeys": [], "writeups": []}
+        elif ttp not in ttpsitw[port]["ttps"]:
+          ttpsitw[port]["ttps"].append(ttp)
+  return ttpsitw
+
+
+def aggregate_current(svl, entries):
+  # the same scope in the shipped code: merge_writeup_ttps() per writeup, then the meta.yml port/ttp pass
+  for facts, writeup in entries:
+    svl.merge_writeup_ttps(facts, writeup)
+  svl.merge_technique_ports()
+  return svl.summary["ttpsitw"]
+
+
+def timeit(func, prepare, runs):
+  timings = []
+  for _ in range(runs):
+    prepare()
+    start = time.perf_counter()
+    result = func()
+    timings.append(time.perf_counter() - start)
+  return sorted(timings), result
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="compare the previous per-writeup port/ttp aggregation of --summarize with the shipped one on a synthetic corpus")
+  parser.add_argument('-n', '--writeups', required=False, action='store', type=int, default=5000, help='synthetic writeups (default: 5000)')
+  parser.add_argument('-m', '--machines', required=False, action='store', type=int, default=None, help='machines in machines.json (default: 5x writeups, at least 50)')
+  parser.add_argument('-r', '--runs', required=False, action='store', type=int, default=5, help='runs per algorithm (default: 5)')
+  parser.add_argument('-s', '--seed', required=False, action='store', type=int, default=1337, help='corpus seed (default: 1337)')
+  parser.add_argument('--json', required=False, action='store_true', help='print results as json')
+  args = parser.parse_args()
+
+  home = tempfile.mkdtemp(prefix="svachal-bench-")
+  try:
+    writeupdir = corpus.generate(home, args.writeups, machines=args.machines, seed=args.seed)
+    os.environ["HOME"] = home
+    svl = svachal.Svachal(writeupdir=writeupdir, githubrepourl=REPOURL)
+    entries = writeup_entries(svl, [svachal.extract_writeup_facts(x.ymlpath) for x in utils.search_writeups(writeupdir)])
+    metadict = utils.load_yaml(svl.config["metayml"])
+
+    legacy, legacyresult = timeit(lambda: aggregate_legacy(entries, metadict["meta"]["ttps"]), lambda: None, args.runs)
+    # every run of the shipped code starts from a fresh summary, as opcode_summarize() does
+    current, currentresult = timeit(lambda: aggregate_current(svl, entries), lambda: svl.init_summary(metadict), args.runs)
+  finally:
+    shutil.rmtree(home, ignore_errors=True)
+  identical = json.dumps(legacyresult) == json.dumps(currentresult)
+
+  results = {
+    "writeups": args.writeups,
+    "legacy": {"min": legacy[0], "median": legacy[len(legacy)//2]},
+    "current": {"min": current[0], "median": current[len(current)//2]},
+    "speedup": legacy[len(legacy)//2] / current[len(current)//2],
+    "identical": identical,
+  }
+  if args.json:
+    print(json.dumps(results, indent=2, sort_keys=True))
+  else:
+    print("legacy   min %8.1fms  median %8.1fms" % (results["legacy"]["min"]*1000, results["legacy"]["median"]*1000))
+    print("current  min %8.1fms  median %8.1fms" % (results["current"]["min"]*1000, results["current"]["median"]*1000))
+    print("speedup  %.1fx (%d writeups, output %s)" % (results["speedup"], args.writeups, "identical" if identical else "DIFFERENT"))
+  sys.exit(0 if identical else 1)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+
+import utils
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS writeups (
+  id INTEGER PRIMARY KEY,
+  dirname TEXT UNIQUE NOT NULL,
+  mtime INTEGER NOT NULL,
+  size INTEGER NOT NULL,
+  name TEXT, path TEXT, url TEXT, infra TEXT, status TEXT, datetime TEXT, points INTEGER, private INTEGER,
+  machineid TEXT, verbose_id TEXT, os TEXT, difficulty TEXT, oscplike INTEGER
+);
+CREATE TABLE IF NOT EXISTS tags (writeup INTEGER NOT NULL REFERENCES writeups(id) ON DELETE CASCADE, tag TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS categories (writeup INTEGER NOT NULL REFERENCES writeups(id) ON DELETE CASCADE, category TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS ports (writeup INTEGER NOT NULL REFERENCES writeups(id) ON DELETE CASCADE, port TEXT NOT NULL, l4 TEXT, proto TEXT, service TEXT, ttps TEXT);
+CREATE TABLE IF NOT EXISTS loot (writeup INTEGER NOT NULL REFERENCES writeups(id) ON DELETE CASCADE, kind TEXT NOT NULL, username TEXT, value TEXT, credtype TEXT);
+CREATE INDEX IF NOT EXISTS idx_tags ON tags (tag, writeup);
+CREATE INDEX IF NOT EXISTS idx_categories ON categories (category, writeup);
+CREATE INDEX IF NOT EXISTS idx_ports ON ports (port, l4, writeup);
+CREATE INDEX IF NOT EXISTS idx_ports_proto ON ports (proto, writeup);
+CREATE INDEX IF NOT EXISTS idx_ports_service ON ports (service, writeup);
+CREATE INDEX IF NOT EXISTS idx_loot ON loot (value, writeup);
+CREATE INDEX IF NOT EXISTS idx_writeups_os ON writeups (os);
+"""
+
+# bumped whenever rows are derived differently, an older catalog is then re-indexed on the next sync
+VERSION = "2"
+
+# query key -> sql condition on writeups w, each filter narrows the result (filters are AND-ed);
+# LIKE values are escaped, so _ and % in ttp/service/name filters match literally
+FILTERS = {
+  "tag": "EXISTS (SELECT 1 FROM tags t WHERE t.writeup = w.id AND t.tag = ?)",
+  "category": "EXISTS (SELECT 1 FROM categories c WHERE c.writeup = w.id AND c.category = ?)",
+  "port": "EXISTS (SELECT 1 FROM ports p WHERE p.writeup = w.id AND p.port = ?)",
+  "proto": "EXISTS (SELECT 1 FROM ports p WHERE p.writeup = w.id AND p.proto = ?)",
+  "service": "EXISTS (SELECT 1 FROM ports p WHERE p.writeup = w.id AND p.service LIKE ? ESCAPE '\\')",
+  "ttp": "EXISTS (SELECT 1 FROM ports p WHERE p.writeup = w.id AND (' ' || p.ttps || ' ') LIKE ? ESCAPE '\\')",
+  "loot": "EXISTS (SELECT 1 FROM loot l WHERE l.writeup = w.id AND (l.value = ? OR l.username = ?))",
+  "os": "w.os = ? COLLATE NOCASE",
+  "infra": "w.infra = ? COLLATE NOCASE",
+  "status": "w.status = ? COLLATE NOCASE",
+  "difficulty": "w.difficulty = ? COLLATE NOCASE",
+  "name": "w.name LIKE ? ESCAPE '\\'",
+}
+
+
+def like_escape(value):
+  return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class Catalog:
+  def __init__(self, dbfile):
+    self.dbfile = dbfile
+    utils.mkdirp(os.path.dirname(os.path.abspath(dbfile)))
+    self.db = sqlite3.connect(dbfile)
+    self.db.row_factory = sqlite3.Row
+    self.db.execute("PRAGMA foreign_keys = ON")
+    self.db.execute("PRAGMA journal_mode = WAL")
+    self.db.executescript(SCHEMA)
+
+  def close(self):
+    self.db.close()
+
+  def get_meta(self, key):
+    row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+  def set_meta(self, key, value):
+    self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+  def known(self):
+    return {row["dirname"]: (row["mtime"], row["size"]) for row in self.db.execute("SELECT dirname, mtime, size FROM writeups")}
+
+  def remove(self, dirname):
+    self.db.execute("DELETE FROM writeups WHERE dirname = ?", (dirname,))
+
+  def update(self, writeup, facts, machine):
+    metadata = facts["metadata"]
+    categories = metadata["categories"] or []
+    if machine and machine.get("os"):
+      osname = str(machine["os"]).lower()
+    else:
+      osname = "windows" if "windows" in categories else "linux" if "linux" in categories else None
+    self.remove(writeup.name)
+    cursor = self.db.execute(
+      "INSERT INTO writeups (dirname, mtime, size, name, path, url, infra, status, datetime, points, private, machineid, verbose_id, os, difficulty, oscplike) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+        writeup.name, writeup.mtime, writeup.size,
+        metadata["name"], metadata["path"], metadata["url"], metadata["infra"], metadata["status"], str(metadata["datetime"]), metadata["points"], int(facts["private"]),
+        str(machine["id"]) if machine and machine.get("id") is not None else None,
+        machine.get("verbose_id") if machine else None,
+        osname,
+        machine.get("difficulty") if machine else None,
+        int(bool(machine.get("oscplike"))) if machine and "oscplike" in machine else int("oscp" in categories),
+      ))
+    rowid = cursor.lastrowid
+    self.db.executemany("INSERT INTO tags (writeup, tag) VALUES (?, ?)", [(rowid, x) for x in sorted(set(metadata["tags"] or [])) if x])
+    self.db.executemany("INSERT INTO categories (writeup, category) VALUES (?, ?)", [(rowid, x) for x in sorted(set(categories)) if x])
+    # ports and ttpsitw are parallel lists (one entry per overview.ttps key), the same port may appear under several keys
+    self.db.executemany("INSERT INTO ports (writeup, port, l4, proto, service, ttps) VALUES (?, ?, ?, ?, ?, ?)", [(rowid, port, l4, proto, service, " ".join(ttpsitw[3])) for (port, l4, proto, service), ttpsitw in zip(facts["ports"], facts["ttpsitw"])])
+    self.db.executemany("INSERT INTO loot (writeup, kind, username, value, credtype) VALUES (?, ?, ?, ?, ?)", [(rowid, "credential", username, password, credtype) for username, password, credtype in facts["loot"]["credentials"]] + [(rowid, "hash", None, x, None) for x in facts["loot"]["hashes"] if x is not None])
+
+  def sync(self, writeups, extract, lookup, machinesmtime=None):
+    # only writeups whose writeup.yml changed (mtime/size) are re-parsed; a changed machines.json refreshes all of them
+    known = self.known()
+    refresh = self.get_meta("version") != VERSION or (machinesmtime is not None and self.get_meta("machinesmtime") != str(machinesmtime))
+    current = set()
+    updated = 0
+    with self.db:
+      for writeup in writeups:
+        current.add(writeup.name)
+        if not refresh and known.get(writeup.name) == (writeup.mtime, writeup.size):
+          continue
+        try:
+          facts = extract(writeup.ymlpath)
+        except Exception as ex:
+          utils.error("failed to catalog '%s': %s" % (writeup.ymlpath, repr(ex)))
+          continue
+        self.update(writeup, facts, lookup(facts["metadata"]["url"]))
+        updated += 1
+      removed = [x for x in known if x not in current]
+      for dirname in removed:
+        self.remove(dirname)
+      self.set_meta("version", VERSION)
+      if machinesmtime is not None:
+        self.set_meta("machinesmtime", str(machinesmtime))
+    return updated, len(removed)
+
+  def query(self, filters):
+    conditions, params = [], []
+    for key, value in filters:
+      if key not in FILTERS:
+        raise ValueError("unknown query key '%s' (expected one of: %s)" % (key, ", ".join(sorted(FILTERS))))
+      if key == "port" and "/" in value:
+        conditions.append("EXISTS (SELECT 1 FROM ports p WHERE p.writeup = w.id AND p.port = ? AND p.l4 = ?)")
+        params.extend(value.split("/", 1))
+        continue
+      conditions.append(FILTERS[key])
+      if key in ["service", "name"]:
+        params.append("%%%s%%" % (like_escape(value)))
+      elif key == "ttp":
+        params.append("%% %s %%" % (like_escape(value)))
+      elif key == "loot":
+        params.extend([value, value])
+      else:
+        params.append(value)
+    sql = "SELECT w.* FROM writeups w%s ORDER BY w.dirname COLLATE NOCASE" % (" WHERE %s" % (" AND ".join(conditions)) if conditions else "")
+    results = []
+    for row in self.db.execute(sql, params).fetchall():
+      entry = dict(row)
+      entry["private"] = bool(entry["private"])
+      entry["oscplike"] = bool(entry["oscplike"])
+      entry["tags"] = [x["tag"] for x in self.db.execute("SELECT tag FROM tags WHERE writeup = ? ORDER BY tag", (row["id"],))]
+      entry["categories"] = [x["category"] for x in self.db.execute("SELECT category FROM categories WHERE writeup = ? ORDER BY category", (row["id"],))]
+      entry["ports"] = ["/".join([x for x in [p["port"], p["l4"], p["proto"], p["service"]] if x]) for p in self.db.execute("SELECT port, l4, proto, service FROM ports WHERE writeup = ? ORDER BY CAST(port AS INTEGER), l4", (row["id"],))]
+      del entry["id"], entry["mtime"], entry["size"]
+      results.append(entry)
+    return results
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import utils
+
+
+class Loot:
+  def __init__(self):
+    # credentials are keyed on (username, password, credtype) and hashes on the hash itself, values are the source writeups
+    self.credentials = {}
+    self.hashes = {}
+
+  def add_credential(self, username, password, credtype, source):
+    key = (username, password, credtype)
+    if key not in self.credentials:
+      self.credentials[key] = set()
+    self.credentials[key].add(source)
+
+  def add_hash(self, hashvalue, source):
+    if hashvalue is None:
+      return
+    if hashvalue not in self.hashes:
+      self.hashes[hashvalue] = set()
+    self.hashes[hashvalue].add(source)
+
+  def add_facts(self, facts, source):
+    for username, password, credtype in facts["credentials"]:
+      self.add_credential(username, password, credtype, source)
+    for hashvalue in facts["hashes"]:
+      self.add_hash(hashvalue, source)
+
+  def sorted_credentials(self):
+    return sorted(self.credentials, key=lambda k: (str(k[2]).casefold(), str(k[0] or "").casefold(), str(k[1] or "").casefold(), str(k)))
+
+  def to_summary(self):
+    return {
+      "hashes": utils.sorted_casefold(self.hashes),
+      "credentials": [{"username": username, "password": password, "credtype": credtype} for username, password, credtype in self.sorted_credentials()],
+    }
+
+  def to_dict(self):
+    return {
+      "hashes": [{"hash": x, "writeups": sorted(self.hashes[x])} for x in utils.sorted_casefold(self.hashes)],
+      "credentials": [{"username": x[0], "password": x[1], "credtype": x[2], "writeups": sorted(self.credentials[x])} for x in self.sorted_credentials()],
+    }
+
+  def save(self, filename):
+    utils.save_json(self.to_dict(), filename)
+
+  @classmethod
+  def load(cls, filename):
+    store = cls()
+    datadict = utils.load_json(filename)
+    for entry in datadict["credentials"]:
+      store.credentials[(entry["username"], entry["password"], entry["credtype"])] = set(entry["writeups"])
+    for entry in datadict["hashes"]:
+      store.hashes[entry["hash"]] = set(entry["writeups"])
+    return store
+
+  def lookup(self, needle):
+    # exact hits come straight from the hash indexes, everything else falls back to a case insensitive substring scan
+    needle = needle.strip()
+    matches = []
+    if needle in self.hashes:
+      matches.append(("hash", None, needle, None, sorted(self.hashes[needle])))
+    else:
+      for hashvalue in utils.sorted_casefold(self.hashes):
+        if needle.casefold() in hashvalue.casefold():
+          matches.append(("hash", None, hashvalue, None, sorted(self.hashes[hashvalue])))
+    for username, password, credtype in self.sorted_credentials():
+      fields = [str(x).casefold() for x in [username, password, credtype] if x is not None]
+      if any(needle.casefold() in x for x in fields):
+        matches.append(("credential", username, password, credtype, sorted(self.credentials[(username, password, credtype)])))
+    return matches
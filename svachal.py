@@ -1,18 +1,22 @@
 #!/usr/bin/env python3
 
-import jq
 import os
+import re
 import sys
+import json
+import time
 import shutil
+import signal
+import tempfile
+import hashlib
 import argparse
 import datetime
+import contextlib
 import subprocess
 
-import yaml
-import jinja2 as jinja
-import markdown2 as markdown
-
+import loot
 import utils
+import catalog
 import yml2dot
 
 
@@ -27,7 +31,22 @@ class Svachal:
     self.config["basedir"] = os.path.dirname(os.path.realpath(__file__))
 
     self.config["machinesjson"] = "%s/toolbox/bootstrap/machines.json" % (utils.expand_env(var="$HOME"))
-    self.machinesstats = utils.load_json(self.config["machinesjson"])
+    self._machinesstats = None
+
+    self.config["statedir"] = "%s/.svachal" % (self.config["writeupdir"])
+    self.config["manifestjson"] = "%s/manifest.json" % (self.config["statedir"])
+    self.config["jinjacachedir"] = "%s/jinja" % (self.config["statedir"])
+    self.config["factsjson"] = "%s/summarize.json" % (self.config["statedir"])
+    self.config["factsversion"] = 1
+    self.config["lootjson"] = "%s/loot.json" % (self.config["statedir"])
+    self.config["catalogdb"] = "%s/catalog.db" % (self.config["statedir"])
+    self.config["latexcachedir"] = "%s/latex" % (self.config["statedir"])
+    self.config["matrixcachedir"] = "%s/matrix" % (self.config["statedir"])
+    self.config["httpcachedir"] = "%s/http" % (self.config["statedir"])
+    self.config["machinescache"] = "%s/machines.cache" % (self.config["statedir"])
+    # machines.json fields needed outside of --summarize, only these are kept in the machines cache
+    self.config["machinefields"] = ["url", "id", "shortname", "name", "os", "points", "oscplike", "infrastructure", "matrix", "difficulty", "difficulty_ratings", "verbose_id"]
+    utils.http_configure(cachedir=self.config["httpcachedir"])
 
     self.config["metayml"] = "%s/meta.yml" % (self.config["writeupdir"])
     self.config["summaryyml"] = "%s/summary.yml" % (self.config["writeupdir"])
@@ -37,7 +56,12 @@ class Svachal:
     self.config["templateyml"] = "%s/template.writeup.yml" % (self.config["basedir"])
 
     self.config["topcount"] = 10
+    self.config["jobs"] = 1
+    self.config["subprocs"] = None
+    self.config["force"] = False
+    self.config["pdfbackend"] = "pandoc"
     self.config["ttpscsv"] = "%s/ttps.csv" % (self.config["writeupdir"])
+    self.config["attackgraphdot"] = "%s/attackgraph.dot" % (self.config["writeupdir"])
 
     self.infra = {
       "HTB": "HackTheBox",
@@ -47,15 +71,167 @@ class Svachal:
 
     self.y2d = yml2dot.YML2DOT(fontsize="large", addrootnode=False, rankdirlr=False, randomnodecolor=False, savehtml=False)
     self.summary = None
+    self.loot = None
+    self.subprocsem = None
+    self.jinjaenvs = {}
+    self.machinesindex = None
+
+  @property
+  def machinesstats(self):
+    # full machines.json, only parsed by --summarize which annotates and rewrites it; lookups are re-indexed on the full entries
+    if self._machinesstats is None:
+      self._machinesstats = utils.load_json(self.config["machinesjson"])
+      self.machinesindex = None
+    return self._machinesstats
+
+  def slim_machines(self, machinesstats):
+    return {
+      "counts": machinesstats.get("counts", {}),
+      "machines": [{k: entry[k] for k in self.config["machinefields"] if k in entry} for entry in machinesstats["machines"]],
+    }
 
-  def _json_query(self, query):
-    try:
-      return jq.compile(query).input(self.machinesstats).all()
-    except:
-      return []
+  def save_machines_cache(self):
+    utils.save_json_cache(self.machinesstats, self.config["machinesjson"], self.config["machinescache"], slim=self.slim_machines, tag=",".join(self.config["machinefields"]))
+
+  def machine_entries(self):
+    # everything but --summarize only reads a few fields per machine, served from a marshal cache of just those fields that
+    # is rebuilt whenever machines.json changes size or mtime
+    if self._machinesstats is not None:
+      return self._machinesstats["machines"]
+    return utils.load_json_cache(self.config["machinesjson"], self.config["machinescache"], slim=self.slim_machines, tag=",".join(self.config["machinefields"]))["machines"]
+
+  def _subproc(self):
+    # bounds concurrent dot/xelatex runs when writeups are rebuilt in parallel
+    return self.subprocsem if self.subprocsem else contextlib.nullcontext()
+
+  def _machine_key(self, key, value):
+    if key == "url":
+      return value.lower().strip().rstrip("/")
+    elif key == "shortname":
+      return utils.cleanup_name(value)
+    return str(value).strip()
+
+  def machine_lookup(self, url=None, id=None, shortname=None):
+    # lazily index machines.json entries by url, id and shortname; entries are shared, not copied
+    if all(value is None or value == "" for value in [url, id, shortname]):
+      return None
+    if self.machinesindex is None:
+      self.machinesindex = {"url": {}, "id": {}, "shortname": {}}
+      for entry in self.machine_entries():
+        for key in self.machinesindex:
+          if entry.get(key) is not None and entry[key] != "":
+            self.machinesindex[key].setdefault(self._machine_key(key, entry[key]), entry)
+    for key, value in [("url", url), ("id", id), ("shortname", shortname)]:
+      if value is not None and value != "":
+        return self.machinesindex[key].get(self._machine_key(key, value))
+
+  def get_jinja_env(self, templatedir):
+    # one environment per templatedir and process; compiled templates are also cached on disk and
+    # the bytecode cache recompiles whenever a template's source checksum changes
+    if templatedir not in self.jinjaenvs:
+      import jinja2 as jinja
+      utils.mkdirp(self.config["jinjacachedir"])
+      env = jinja.Environment(loader=jinja.FileSystemLoader(templatedir), trim_blocks=True, lstrip_blocks=True, bytecode_cache=jinja.FileSystemBytecodeCache(self.config["jinjacachedir"]))
+      env.filters.update(utils.get_jinja_filters())
+      self.jinjaenvs[templatedir] = env
+    return self.jinjaenvs[templatedir]
+
+  def pdf_command(self, destdir, mdname, pdfname):
+    return ['pandoc', '%s/%s' % (destdir, mdname), '-o', '%s/%s' % (destdir, pdfname), '--from', 'markdown+yaml_metadata_block+raw_html', '--highlight-style', 'tango', '--pdf-engine=xelatex']
+
+  def latex_format(self, preamble):
+    # precompile the shared preamble prefix into a xelatex format with mylatexformat, cached by content
+    xelatex = shutil.which("xelatex")
+    if not xelatex:
+      return None
+    digest = hashlib.sha256(("%s\n%s\n%s" % (xelatex, os.stat(xelatex).st_mtime_ns, preamble)).encode("utf-8")).hexdigest()[:16]
+    fmtname = "svachal-%s" % (digest)
+    fmtfile = "%s/%s.fmt" % (self.config["latexcachedir"], fmtname)
+    failedfile = "%s/%s.failed" % (self.config["latexcachedir"], fmtname)
+    if os.path.isfile(fmtfile):
+      return fmtname
+    if os.path.isfile(failedfile):
+      return None
+
+    utils.mkdirp(self.config["latexcachedir"])
+    # unique jobname so parallel rebuilds never write the same format, the first finished one is renamed into place
+    jobname = "%s.%d" % (fmtname, os.getpid())
+    utils.file_save("%s/%s.tex" % (self.config["latexcachedir"], jobname), "%s\n\\csname endofdump\\endcsname\n\\begin{document}\n\\end{document}\n" % (preamble))
+    results = subprocess.run([xelatex, '-ini', '-interaction=nonstopmode', '-jobname=%s' % (jobname), '&xelatex', 'mylatexformat.ltx', '%s.tex' % (jobname)], cwd=self.config["latexcachedir"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if results.returncode == 0 and os.path.isfile("%s/%s.fmt" % (self.config["latexcachedir"], jobname)):
+      os.replace("%s/%s.fmt" % (self.config["latexcachedir"], jobname), fmtfile)
+      utils.info("precompiled latex preamble into '%s'" % (fmtfile))
+    else:
+      utils.file_save(failedfile, results.stdout.decode("utf-8", "replace"))
+      utils.warn("could not precompile latex preamble (exit code %d, see '%s'), using pandoc for pdfs" % (results.returncode, failedfile))
+    for ext in ["tex", "log", "fmt"]:
+      if os.path.isfile("%s/%s.%s" % (self.config["latexcachedir"], jobname, ext)):
+        os.remove("%s/%s.%s" % (self.config["latexcachedir"], jobname, ext))
+    return fmtname if os.path.isfile(fmtfile) else None
+
+  def pdf_job(self, destdir, mdname, pdfname):
+    # returns (cmd, env, builddir, builtpdf): cmd writes builtpdf, which then has to be moved over destdir/pdfname.
+    # with the "fmt" backend pandoc only renders latex and xelatex runs against a cached precompiled preamble
+    if self.config["pdfbackend"] != "fmt":
+      return self.pdf_command(destdir, mdname, pdfname), None, None, None
+
+    builddir = "%s/build/%s" % (self.config["latexcachedir"], hashlib.sha256(os.path.abspath(destdir).encode("utf-8")).hexdigest()[:16])
+    utils.mkdirp(builddir)
+    jobname = os.path.splitext(pdfname)[0]
+    texfile = "%s/%s.tex" % (builddir, jobname)
+    results = subprocess.run(['pandoc', '%s/%s' % (destdir, mdname), '-s', '-t', 'latex', '-o', texfile, '--from', 'markdown+yaml_metadata_block+raw_html', '--highlight-style', 'tango', '--pdf-engine=xelatex'], cwd=destdir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if results.returncode != 0:
+      raise RuntimeError("pandoc exited with %d: %s" % (results.returncode, results.stderr.decode("utf-8", "replace").strip()))
+
+    # everything before the writeup specific header-includes, \hypersetup and font selection is shared by all writeups
+    mdtext = utils.file_open("%s/%s" % (destdir, mdname))
+    headerincludes = utils.md_frontmatter(mdtext).get("header-includes") or []
+    headerincludes = [headerincludes] if isinstance(headerincludes, str) else headerincludes
+    stops = [re.compile(r"^\\(hypersetup|title|author|date|setmainfont|setsansfont|setmonofont|setmathfont)\b")]
+    stops.extend([re.compile("^%s" % (re.escape(str(x).strip().split("\n")[0]))) for x in headerincludes if x and str(x).strip()])
+    lines = utils.file_open(texfile).split("\n")
+    dumpidx = utils.tex_dump_point(lines, stops)
+    fmtname = self.latex_format("\n".join(lines[:dumpidx])) if dumpidx > 1 else None
+    if not fmtname:
+      return self.pdf_command(destdir, mdname, pdfname), None, None, None
+
+    lines.insert(dumpidx, "\\csname endofdump\\endcsname")
+    utils.file_save(texfile, "\n".join(lines))
+    env = dict(os.environ, TEXFORMATS="%s:" % (os.path.abspath(self.config["latexcachedir"])))
+    cmd = ['xelatex', '-interaction=nonstopmode', '-halt-on-error', '-fmt=%s' % (fmtname), '-output-directory=%s' % (os.path.abspath(builddir)), '-jobname=%s' % (jobname), os.path.abspath(texfile)]
+    return cmd, env, builddir, "%s/%s.pdf" % (builddir, jobname)
 
   def md2pdf(self, destdir, mdname, pdfname):
-    results = subprocess.run(['pandoc', '%s/%s' % (destdir, mdname), '-o', '%s/%s' % (destdir, pdfname), '--from', 'markdown+yaml_metadata_block+raw_html', '--highlight-style', 'tango', '--pdf-engine=xelatex'], cwd=destdir, stdout=subprocess.PIPE).stdout.decode('utf-8')
+    cmd, env, builddir, builtpdf = self.pdf_job(destdir, mdname, pdfname)
+    # xelatex needs another pass while references/bookmarks are settling; aux files persist in builddir between runs
+    for _ in range(3 if builtpdf else 1):
+      results = subprocess.run(cmd, cwd=destdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+      if results.returncode != 0:
+        raise RuntimeError("%s exited with %d: %s" % (cmd[0], results.returncode, "\n".join(results.stdout.decode("utf-8", "replace").strip().split("\n")[-20:])))
+      if not builtpdf or "Rerun to get" not in results.stdout.decode("utf-8", "replace"):
+        break
+    if builtpdf:
+      shutil.move(builtpdf, "%s/%s" % (destdir, pdfname))
+
+  def render_markdown(self, dictyml, templatefile, templatedir, destdir, destfile):
+    template = self.get_jinja_env(templatedir).get_template(templatefile)
+    rendermd = template.render(dictyml)
+    destfilepath = "%s/%s" % (destdir, destfile)
+    utils.file_save(destfilepath, rendermd)
+    return destfilepath
+
+  def render_killchain(self, dictyml, ymlfile, destfile, render=True):
+    # with render=False the changed .dot is only queued in self.y2d.pending for a batched self.y2d.flush()
+    try:
+      parentdir = "/".join(ymlfile.split("/")[:-1])
+      dotfile = "%s/killchain.dot" % (parentdir)
+      with self._subproc():
+        self.y2d.process(dictyml["writeup"]["overview"]["killchain"], dotfile, render=render)
+      return True
+    except Exception as ex:
+      print("exception! failed to create overview killchain '%s'. please check below for more details:" % (destfile))
+      print(repr(ex))
+      return False
 
   def yml2md(self, ymlfile, templatefile, templatedir, destdir, destfile, ignoreprivate=False):
     dictyml = utils.load_yaml(ymlfile)
@@ -65,100 +241,64 @@ class Svachal:
         #utils.warn("writeup file '%s' is not marked for publishing (status == private)" % (ymlfile))
         return
 
-    env = jinja.Environment(loader=jinja.FileSystemLoader(templatedir), trim_blocks=True, lstrip_blocks=True)
-    env.filters["datetimefilter"] = utils.datetimefilter
-    env.filters["ghsearchlinks"] = utils.ghsearchlinks
-    env.filters["anchorformat"] = utils.anchorformat
-    env.filters["anchorformatttps"] = utils.anchorformatttps
-    env.filters["mdurl"] = utils.mdurl
-    env.filters["obfuscate"] = utils.obfuscate
-    env.filters["monojoin"] = utils.monojoin
-    env.filters["customsort"] = utils.customsort
-    template = env.get_template(templatefile)
-    rendermd = template.render(dictyml)
-    destfilepath = "%s/%s" % (destdir, destfile)
-    utils.file_save(destfilepath, rendermd)
+    destfilepath = self.render_markdown(dictyml, templatefile, templatedir, destdir, destfile)
 
     if "summary.yml" not in ymlfile:
       if dictyml["writeup"].get("overview") and dictyml["writeup"]["overview"]["killchain"]:
-        try:
-          parentdir = "/".join(ymlfile.split("/")[:-1])
-          dotfile = "%s/killchain.dot" % (parentdir)
-          killchain = self.y2d.process(dictyml["writeup"]["overview"]["killchain"], dotfile)
-        except Exception as ex:
-          print("exception! failed to create overview killchain '%s'. please check below for more details:" % (destfile))
-          print(repr(ex))
-
-      try:
-        self.md2pdf(destdir, destfile, "writeup.pdf")
-      except Exception as ex:
-        print("exception! md file '%s' could not be converted to pdf. please check below for more details:" % (destfile))
-        print(repr(ex))
+        self.render_killchain(dictyml, ymlfile, destfile)
+      self.render_pdf(destdir, destfile)
 
     return destfilepath
 
+  def render_pdf(self, destdir, destfile):
+    try:
+      with self._subproc():
+        self.md2pdf(destdir, destfile, "writeup.pdf")
+      return True
+    except Exception as ex:
+      print("exception! md file '%s' could not be converted to pdf. please check below for more details:" % (destfile))
+      print(repr(ex))
+      return False
+
   def plot(self):
-    utils.to_xkcd(
-      plotdict=dict(sorted(sorted(self.summary["plot"]["ports"].items(), key=lambda x: x[1], reverse=True)[:self.config["topcount"]])),
-      filename="%s/top_ports.png" % (self.config["writeupdir"]),
-      title="Top Ports",
-      rotate=True
-    )
-    utils.to_xkcd(
-      plotdict=dict(sorted(sorted(self.summary["plot"]["protocols"].items(), key=lambda x: x[1], reverse=True)[:self.config["topcount"]])),
-      filename="%s/top_protocols.png" % (self.config["writeupdir"]),
-      title="Top Protocols",
-      rotate=True
-    )
-    utils.to_xkcd(
-      plotdict=dict(sorted(sorted(self.summary["plot"]["services"].items(), key=lambda x: x[1], reverse=True)[:self.config["topcount"]])),
-      filename="%s/top_services.png" % (self.config["writeupdir"]),
-      title="Top Services",
-      rotate=True
-    )
+    charts = []
+    for key, filename, title in [
+      ("ports", "top_ports.png", "Top Ports"),
+      ("protocols", "top_protocols.png", "Top Protocols"),
+      ("services", "top_services.png", "Top Services"),
+      ("categories", "top_categories.png", "Top Categories"),
+    ]:
+      charts.append({
+        "plotdict": dict(sorted(sorted(self.summary["plot"][key].items(), key=lambda x: x[1], reverse=True)[:self.config["topcount"]])),
+        "filename": "%s/%s" % (self.config["writeupdir"], filename),
+        "title": title,
+        "rotate": True,
+      })
+    for prefix, filename, title in [
+      ("enumerate_", "top_ttps_enumerate.png", "Top TTPs - Phase #1 Enumeration"),
+      ("exploit_", "top_ttps_exploit.png", "Top TTPs - Phase #2 Exploitation"),
+      ("privesc_", "top_ttps_privesc.png", "Top TTPs - Phase #3 Privilege Escalation"),
+    ]:
+      plotdict = {k: v for k, v in self.summary["plot"]["ttps"].items() if k.startswith(prefix)}
+      charts.append({
+        "plotdict": dict(sorted(sorted(plotdict.items(), key=lambda x: x[1], reverse=True)[:self.config["topcount"]])),
+        "filename": "%s/%s" % (self.config["writeupdir"], filename),
+        "title": title,
+        "rotate": True,
+      })
 
-    utils.to_xkcd(
-      plotdict=dict(sorted(sorted(self.summary["plot"]["categories"].items(), key=lambda x: x[1], reverse=True)[:self.config["topcount"]])),
-      filename="%s/top_categories.png" % (self.config["writeupdir"]),
-      title="Top Categories",
-      rotate=True
-    )
+    if self.config["jobs"] > 1:
+      import concurrent.futures
+      with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.config["jobs"], len(charts))) as executor:
+        rendered = list(executor.map(_plot_chart, charts))
+    else:
+      rendered = [utils.to_xkcd(**chart) for chart in charts]
+    utils.info("rendered %d charts (unchanged: %d)" % (rendered.count(True), rendered.count(False)))
 
-    plotdict = {k: v for k, v in self.summary["plot"]["ttps"].items() if k.startswith("enumerate_")}
-    utils.to_xkcd(
-      plotdict=dict(sorted(sorted(plotdict.items(), key=lambda x: x[1], reverse=True)[:self.config["topcount"]])),
-      filename="%s/top_ttps_enumerate.png" % (self.config["writeupdir"]),
-      title="Top TTPs - Phase #1 Enumeration",
-      rotate=True
-    )
-    plotdict = {k: v for k, v in self.summary["plot"]["ttps"].items() if k.startswith("exploit_")}
-    utils.to_xkcd(
-      plotdict=dict(sorted(sorted(plotdict.items(), key=lambda x: x[1], reverse=True)[:self.config["topcount"]])),
-      filename="%s/top_ttps_exploit.png" % (self.config["writeupdir"]),
-      title="Top TTPs - Phase #2 Exploitation",
-      rotate=True
-    )
-    plotdict = {k: v for k, v in self.summary["plot"]["ttps"].items() if k.startswith("privesc_")}
-    utils.to_xkcd(
-      plotdict=dict(sorted(sorted(plotdict.items(), key=lambda x: x[1], reverse=True)[:self.config["topcount"]])),
-      filename="%s/top_ttps_privesc.png" % (self.config["writeupdir"]),
-      title="Top TTPs - Phase #3 Privilege Escalation",
-      rotate=True
-    )
+  def render_matrix(self, machine, destdirpath):
+    return utils.to_radar(machine["matrix"]["aggregate"], machine["matrix"]["maker"], filename="%s/matrix.png" % (destdirpath), machineid=machine.get("id"), cachedir=self.config["matrixcachedir"])
 
   def url2metadata(self, url):
-    def search_by_key(data, machines, key="url"):
-      if machines and len(machines):
-        for entry in machines:
-          if key in ["name"]:
-            if data in entry[key].lower().strip():
-              return entry
-          if key in ["url"]:
-            if data == entry[key].lower().strip():
-              return entry
-          elif key in ["id"]:
-            if data == entry[key]:
-              return entry
     url = url.lower().strip()
     stats, infra = None, ""
     writeupyml = utils.load_yaml(self.config["templateyml"])
@@ -173,7 +313,7 @@ class Svachal:
     writeupyml["writeup"]["metadata"]["categories"] = []
     writeupyml["writeup"]["metadata"]["infra"] = "misc"
     writeupyml["writeup"]["metadata"]["path"] = "misc.unknown"
-    stats = search_by_key(url, self.machinesstats["machines"], key="url")
+    stats = self.machine_lookup(url=url)
     if stats:
       writeupyml["writeup"]["metadata"]["name"] = "%s" % (stats["name"])
       writeupyml["writeup"]["metadata"]["points"] = stats["points"] if stats.get("points") and stats["points"] else None
@@ -272,20 +412,15 @@ class Svachal:
       updatedwriteupyml = "%s\n%s" % (self.metadata2yml(metadata), "\n".join(writeupyml.split("\n")[23:]))
       utils.file_save(self.config["writeupyml"], updatedwriteupyml)
       utils.info("writeup file '%s' created for target '%s'" % (self.config["writeupyml"], self.config["destdirname"]))
-      for machine in self.machinesstats["machines"]:
-        if machine["url"] == metadata["url"]:
-
-          if machine.get("difficulty_ratings") and machine["difficulty_ratings"]:
-            utils.to_sparklines(machine["difficulty_ratings"] if machine["difficulty_ratings"] else [], filename="%s/ratings.png" % (self.config["destdirpath"]))
-            utils.info("created '%s/ratings.png' file for target '%s'" % (self.config["destdirpath"], self.config["destdirname"]))
+      machine = self.machine_lookup(url=metadata["url"])
+      if machine:
+        if machine.get("difficulty_ratings") and machine["difficulty_ratings"]:
+          utils.to_sparklines(machine["difficulty_ratings"] if machine["difficulty_ratings"] else [], filename="%s/ratings.png" % (self.config["destdirpath"]))
+          utils.info("created '%s/ratings.png' file for target '%s'" % (self.config["destdirpath"], self.config["destdirname"]))
 
-          if machine.get("matrix") and machine["matrix"]:
-            url = "https://quickchart.io/chart?bkg=rgba(255,255,255,0.2)&width=270&height=200&c={ type: 'radar', data: {fill: 'False', labels: ['Enumeration', 'Real-Life', 'CVE', ['Custom', 'Exploitation'], 'CTF-Like'], datasets: [{ label: 'User rated', data: %s, backgroundColor:'rgba(154,204,20,0.2)', borderColor:'rgb(154,204,20)', pointBackgroundColor:'rgb(154,204,20)' }, { label: 'Maker rated', data: %s, backgroundColor:'rgba(86,192,224,0.2)', borderColor:'rgb(86,192,224)', pointBackgroundColor:'rgb(86,192,224)' }] }, options: { layout:{ padding:25}, plugins: { legend: false,}, scale: { angleLines: { display: true, color: 'rgb(21,23,25)' }, ticks: { callback: function() {return ''}, backdropColor: 'rgba(0, 0, 0, 0)' }, gridLines: { color: 'rgb(51,54,60)', } }, } }" % (machine["matrix"]["aggregate"], machine["matrix"]["maker"])
-            res = utils.get_http_res(url, requoteuri=True)
-            filename = "%s/matrix.png" % (self.config["destdirpath"])
-            with open(filename, "wb") as fp:
-              fp.write(res.content)
-            utils.info("created '%s/matrix.png' file for target '%s'" % (self.config["destdirpath"], self.config["destdirname"]))
+        if machine.get("matrix") and machine["matrix"]:
+          self.render_matrix(machine, self.config["destdirpath"])
+          utils.info("created '%s/matrix.png' file for target '%s'" % (self.config["destdirpath"], self.config["destdirname"]))
 
     else:
       utils.warn("writeup file '%s' already exists for target '%s'" % (self.config["writeupyml"], self.config["destdirname"]))
@@ -298,21 +433,401 @@ class Svachal:
     else:
       self.yml2md(self.config["writeupyml"], self.config["templatefile"], self.config["templatedir"], self.config["destdirpath"], "writeup.md", ignoreprivate=True)
 
+  def opcode_watch(self, interval=0.5, debounce=0.3):
+    # poll $PWD/writeup.yml and the files it references; after a burst of saves settles, markdown is always
+    # re-rendered, the killchain only when overview.killchain changed, and the pdf last in a cancellable subprocess
+    self.config["destdirpath"] = "."
+    self.config["writeupyml"] = "%s/writeup.yml" % (self.config["destdirpath"])
+    if not os.path.isfile(self.config["writeupyml"]):
+      utils.error("could not find writeup file '%s'" % (self.config["writeupyml"]))
+      return
+
+    def stat(filename):
+      try:
+        st = os.stat(filename)
+        return (st.st_mtime_ns, st.st_size)
+      except FileNotFoundError:
+        return None
+
+    def cancel(pdfproc):
+      if pdfproc and pdfproc.poll() is None:
+        try:
+          os.killpg(pdfproc.pid, signal.SIGTERM)
+        except ProcessLookupError:
+          pass
+        pdfproc.wait()
+        return True
+      return False
+
+    def snapshot(refs):
+      return stat(self.config["writeupyml"]), tuple((ref, stat("%s/%s" % (self.config["destdirpath"], ref))) for ref in refs)
+
+    refs, polled, ymlseen, killchainseen = [], None, None, None
+    changedat, pdfproc, pdfstart, pdfbuilt, pdflog = None, None, None, None, tempfile.TemporaryFile()
+    utils.info("watching '%s' for changes (ctrl+c to stop)" % (os.path.abspath(self.config["writeupyml"])))
+    try:
+      while True:
+        current = snapshot(refs)
+        if current != polled:
+          polled, changedat = current, time.monotonic()
+
+        if changedat is not None and time.monotonic() - changedat >= debounce:
+          changedat = None
+          if cancel(pdfproc):
+            utils.warn("cancelled writeup.pdf build for a newer save")
+          pdfproc = None
+          try:
+            dictyml = utils.load_yaml(self.config["writeupyml"])
+          except Exception as ex:
+            utils.error("could not load '%s': %s" % (self.config["writeupyml"], repr(ex)))
+            dictyml = None
+          if dictyml:
+            if polled[0] != ymlseen:
+              ymlseen = polled[0]
+              start = time.monotonic()
+              self.render_markdown(dictyml, self.config["templatefile"], self.config["templatedir"], self.config["destdirpath"], "writeup.md")
+              utils.info("rendered writeup.md in %.2fs" % (time.monotonic() - start))
+              killchain = dictyml["writeup"]["overview"].get("killchain") if dictyml.get("writeup") and dictyml["writeup"].get("overview") else None
+              killchainkey = hashlib.sha256(json.dumps(killchain, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+              if killchain and (killchainkey != killchainseen or not os.path.isfile("%s/killchain.png" % (self.config["destdirpath"]))):
+                start = time.monotonic()
+                self.render_killchain(dictyml, self.config["writeupyml"], "writeup.md")
+                utils.info("rendered killchain.png in %.2fs" % (time.monotonic() - start))
+              killchainseen = killchainkey
+              # screenshots added or removed in this save are watched from now on; only new refs take their current
+              # stat, writeup.yml and known refs keep the pre-render one so saves made while rendering are picked up
+              refs = sorted(set(utils.file_refs(dictyml)))
+              seen = dict(polled[1])
+              polled = (polled[0], tuple((ref, seen[ref] if ref in seen else st) for ref, st in snapshot(refs)[1]))
+            pdfstart = time.monotonic()
+            pdflog.seek(0)
+            pdflog.truncate()
+            try:
+              cmd, env, builddir, pdfbuilt = self.pdf_job(self.config["destdirpath"], "writeup.md", "writeup.pdf")
+              pdfproc = subprocess.Popen(cmd, cwd=self.config["destdirpath"], env=env, stdout=pdflog, stderr=subprocess.STDOUT, start_new_session=True)
+            except Exception as ex:
+              utils.error("writeup.pdf build failed: %s" % (repr(ex)))
+
+        if pdfproc and pdfproc.poll() is not None:
+          if pdfproc.returncode == 0:
+            if pdfbuilt:
+              shutil.move(pdfbuilt, "%s/writeup.pdf" % (self.config["destdirpath"]))
+            utils.info("rendered writeup.pdf in %.2fs" % (time.monotonic() - pdfstart))
+          else:
+            pdflog.seek(0)
+            utils.error("writeup.pdf build failed (exit code %d): %s" % (pdfproc.returncode, "\n".join(pdflog.read().decode("utf-8", "replace").strip().split("\n")[-20:])))
+          pdfproc = None
+        time.sleep(interval)
+    except KeyboardInterrupt:
+      cancel(pdfproc)
+      pdflog.close()
+      utils.info("stopped watching '%s'" % (os.path.abspath(self.config["writeupyml"])))
+
+  def writeup_digest(self, writeupyml, dictyml):
+    # hash everything a rendered writeup depends on: yml, referenced files, template, filters and machine entry
+    parentdir = os.path.dirname(writeupyml)
+    digest = hashlib.sha256()
+    digest.update(("yml:%s\n" % (utils.file_sha256(writeupyml))).encode("utf-8"))
+    for ref in sorted(set(utils.file_refs(dictyml))):
+      digest.update(("ref:%s:%s\n" % (ref, utils.file_sha256("%s/%s" % (parentdir, ref)))).encode("utf-8"))
+    digest.update(("template:%s\n" % (utils.file_sha256("%s/%s" % (self.config["templatedir"], self.config["templatefile"])))).encode("utf-8"))
+    digest.update(("filters:%s\n" % (utils.get_jinja_filters_version())).encode("utf-8"))
+    machine = {}
+    if dictyml and dictyml.get("writeup") and dictyml["writeup"].get("metadata") and dictyml["writeup"]["metadata"].get("url"):
+      entry = self.machine_lookup(url=dictyml["writeup"]["metadata"]["url"])
+      if entry:
+        # only the cached fields, so full (--summarize) and cached entries hash the same; writeups annotations are
+        # added by --summarize and do not affect rendered output
+        machine = {k: entry[k] for k in self.config["machinefields"] if k in entry}
+    digest.update(("machine:%s\n" % (json.dumps(machine, sort_keys=True, default=str))).encode("utf-8"))
+    return digest.hexdigest()
+
+  def rebuild_writeup(self, writeupyml, destdirpath, knowndigest=None):
+    # first rebuild stage: markdown only, changed killchains are returned for one batched dot run and pdfs come last
+    dictyml = utils.load_yaml(writeupyml)
+    digest = self.writeup_digest(writeupyml, dictyml)
+    destfilepath = "%s/writeup.md" % (destdirpath)
+    # an unchanged writeup is only skipped while all of its outputs exist, so deleted or never rendered ones are rebuilt
+    outputs = ["writeup.md", "writeup.pdf"]
+    if dictyml.get("writeup") and dictyml["writeup"].get("overview") and dictyml["writeup"]["overview"].get("killchain"):
+      outputs.append("killchain.png")
+    if knowndigest and digest == knowndigest and all(os.path.isfile("%s/%s" % (destdirpath, x)) for x in outputs):
+      return "skipped", digest, destfilepath, []
+    if dictyml.get("writeup") and dictyml["writeup"]["metadata"]["status"].lower().strip() == "private":
+      return "private", digest, None, []
+    destfilepath = self.render_markdown(dictyml, self.config["templatefile"], self.config["templatedir"], destdirpath, "writeup.md")
+    if dictyml["writeup"].get("overview") and dictyml["writeup"]["overview"]["killchain"]:
+      if not self.render_killchain(dictyml, writeupyml, "writeup.md", render=False):
+        self.y2d.pending = []
+        return "failed", None, destfilepath, []
+    dotfiles, self.y2d.pending = self.y2d.pending, []
+    return "built", digest, destfilepath, dotfiles
+
+  def render_killchains(self, dotfiles):
+    # a handful of dot processes with many graphs each instead of one process and layout per writeup, returns the rendered dotfiles
+    if not dotfiles:
+      return []
+    batches = max(1, min(self.config["subprocs"] or self.config["jobs"], len(dotfiles)))
+    if batches == 1:
+      rendered = self.y2d.render(dotfiles)
+    else:
+      import concurrent.futures
+      with concurrent.futures.ThreadPoolExecutor(max_workers=batches) as executor:
+        rendered = [dotfile for batch in executor.map(self.y2d.render, [dotfiles[idx::batches] for idx in range(batches)]) for dotfile in batch]
+    self.y2d.discard(dotfiles, rendered)
+    return rendered
+
   def opcode_rebuildall(self):
-    writeupdirs = [x.replace("/writeup.yml", "").split("/")[-1] for x in utils.search_files_yml(self.config["writeupdir"])]
-    total = len(writeupdirs)
-    privatewriteups = []
-    for idx, wd in enumerate(sorted(writeupdirs, key=str.casefold)):
-      destdirpath = "%s/%s" % (self.config["writeupdir"], wd)
-      writeupyml = "%s/writeup.yml" % (destdirpath)
-      destfilepath = self.yml2md(writeupyml, self.config["templatefile"], self.config["templatedir"], destdirpath, "writeup.md")
-      print("(%03d/%03d) '%s' → '%s'" % (idx+1, total, writeupyml, destfilepath))
-      if not destfilepath:
-        privatewriteups.append(writeupyml)
-    utils.info("rebuilt %d writeups @ %s (private: %d)" % (total-len(privatewriteups), self.config["writeupdir"], len(privatewriteups)))
+    writeups = utils.search_writeups(self.config["writeupdir"])
+    total = len(writeups)
+    manifest = utils.load_json(self.config["manifestjson"]) if os.path.isfile(self.config["manifestjson"]) else {}
+    knowndigests = {} if self.config["force"] else manifest.get("writeups", {})
+    results = {"built": [], "skipped": [], "private": [], "failed": []}
+    digests, dotfiles, builtdirs, owners = {}, [], [], {}
+
+    def report(idx, writeup, status, digest, destfilepath, pending):
+      results[status].append(writeup.ymlpath)
+      if status in ["built", "skipped"]:
+        digests[writeup.name] = digest
+      if status == "built":
+        builtdirs.append(writeup.dirpath)
+        dotfiles.extend(pending)
+        owners[writeup.dirpath] = writeup
+        owners.update({dotfile: writeup for dotfile in pending})
+      if status == "failed":
+        return
+      print("(%03d/%03d) '%s' → '%s'%s" % (idx+1, total, writeup.ymlpath, destfilepath, " (unchanged)" if status == "skipped" else ""))
+
+    if self.config["jobs"] > 1:
+      import multiprocessing
+      import concurrent.futures
+      subprocs = self.config["subprocs"] if self.config["subprocs"] else self.config["jobs"]
+      semaphore = multiprocessing.BoundedSemaphore(subprocs)
+      with concurrent.futures.ProcessPoolExecutor(max_workers=self.config["jobs"], initializer=_rebuild_init, initargs=(self.config["writeupdir"], self.config["githubrepourl"], semaphore, self.config["pdfbackend"])) as executor:
+        futures = {}
+        for writeup in writeups:
+          futures[executor.submit(_rebuild_writeup, writeup.ymlpath, writeup.dirpath, knowndigests.get(writeup.name))] = writeup
+        for idx, future in enumerate(concurrent.futures.as_completed(futures)):
+          writeup = futures[future]
+          try:
+            status, digest, destfilepath, pending = future.result()
+          except Exception as ex:
+            utils.error("failed to rebuild '%s': %s" % (writeup.ymlpath, repr(ex)))
+            status, digest, destfilepath, pending = "failed", None, None, []
+          report(idx, writeup, status, digest, destfilepath, pending)
+        rendered = self.render_killchains(sorted(dotfiles))
+        builtdirs = sorted(builtdirs)
+        pdfs = list(executor.map(_rebuild_pdf, builtdirs))
+    else:
+      for idx, writeup in enumerate(writeups):
+        try:
+          status, digest, destfilepath, pending = self.rebuild_writeup(writeup.ymlpath, writeup.dirpath, knowndigests.get(writeup.name))
+        except Exception as ex:
+          utils.error("failed to rebuild '%s': %s" % (writeup.ymlpath, repr(ex)))
+          status, digest, destfilepath, pending = "failed", None, None, []
+        report(idx, writeup, status, digest, destfilepath, pending)
+      rendered = self.render_killchains(dotfiles)
+      pdfs = [self.render_pdf(destdirpath, "writeup.md") for destdirpath in builtdirs]
+
+    # writeups whose killchain or pdf did not render stay out of the manifest, so the next run retries them
+    failed = [owners[x] for x in sorted(set(dotfiles) - set(rendered))] + [owners[x] for x, ok in zip(builtdirs, pdfs) if not ok]
+    for writeup in failed:
+      if writeup.ymlpath in results["built"]:
+        utils.error("failed to rebuild '%s': killchain or pdf rendering failed" % (writeup.ymlpath))
+        results["built"].remove(writeup.ymlpath)
+        results["failed"].append(writeup.ymlpath)
+        del digests[writeup.name]
+
+    manifest["writeups"] = dict(sorted(digests.items()))
+    utils.mkdirp(self.config["statedir"])
+    utils.save_json(manifest, self.config["manifestjson"])
+    utils.info("rebuilt %d writeups @ %s (built: %d, skipped: %d, private: %d, failed: %d, killchains: %d)" % (total-len(results["private"])-len(results["failed"]), self.config["writeupdir"], len(results["built"]), len(results["skipped"]), len(results["private"]), len(results["failed"]), len(rendered)))
+
+  def update_machines_ttps(self, ttpannotations):
+    updated = 0
+    for url in ttpannotations:
+      entry = self.machine_lookup(url=url)
+      if not entry:
+        continue
+      if entry.get("writeups") and entry["writeups"].get("7h3rAm") == ttpannotations[url]:
+        continue
+      if not entry.get("writeups"):
+        entry["writeups"] = {}
+      entry["writeups"]["7h3rAm"] = ttpannotations[url]
+      updated += 1
+    if updated:
+      utils.save_json(self.machinesstats, self.config["machinesjson"])
+      self.save_machines_cache()
+      utils.info("updated %s with ttps from %d writeups" % (self.config["machinesjson"], updated))
+    return updated
+
+  def merge_writeup_facts(self, facts, machines, private, ttpannotations):
+    metadata = facts["metadata"]
+    writeupmdurl = "%s/blob/master/%s/writeup.md" % (self.config["githubrepourl"], metadata["path"])
+    writeuppdfurl = "%s/blob/master/%s/writeup.pdf" % (self.config["githubrepourl"], metadata["path"])
+    killchainurl = "%s/blob/master/%s/killchain.png" % (self.config["githubrepourl"], metadata["path"])
+
+    entry = self.machine_lookup(url=metadata["url"])
+    if entry:
+      machine = dict(entry)
+    else:
+      machine = {
+        "name": metadata["name"],
+        "url": metadata["url"],
+      }
+    machine["writeupmdurl"] = writeupmdurl
+    machine["writeuppdfurl"] = writeuppdfurl
+    machine["killchainurl"] = killchainurl
+    machine["verbose_id"] = machine["verbose_id"] if "verbose_id" in machine else "%s#%s" % (metadata["infra"].lower().strip(), metadata["name"].replace(" ", "").lower().strip())
+    if "oscplike" not in machine:
+      machine["oscplike"] = True if "oscp" in metadata["categories"] else False
+    machine["os"] = machine.get("os")
+    machine["private"] = facts["private"]
+    machine["owned_user"] = True if metadata["status"].lower().strip() == "public" else False
+    machine["owned_root"] = True if metadata["status"].lower().strip() == "public" else False
+    if machine.get("difficulty_ratings") and machine["difficulty_ratings"]:
+      machine["ratingsurl"] = "%s/blob/master/%s/ratings.png" % (self.config["githubrepourl"], metadata["path"])
+      machine["matrixurl"] = "%s/blob/master/%s/matrix.png" % (self.config["githubrepourl"], metadata["path"])
+    else:
+      machine["ratingsurl"] = None
+      machine["matrixurl"] = None
+
+    machines.append(machine)
+
+    if facts["private"]:
+      private.append(metadata["path"])
+      return
+
+    for key in facts["counts"]:
+      self.summary["counts"][key] += facts["counts"][key]
+
+    # uncomment lines below if matrix.png has to be updated
+    #if machine.get("matrix"):
+    #  utils.to_sparklines(machine["difficulty_ratings"] if machine["difficulty_ratings"] else [], filename="%s/ratings.png" % (destdirpath))
+    #  self.render_matrix(machine, destdirpath)
+
+    verbose_id = machine["verbose_id"].replace("hackthebox", "htb").replace("vulnhub", "vh")
+    for tag in metadata["tags"]:
+      for phase in ["enumerate", "exploit", "privesc"]:
+        if tag.startswith("%s_" % (phase)):
+          if None in self.summary["techniques"][phase][tag]["references"]:
+            self.summary["techniques"][phase][tag]["references"] = []
+          if "writeups" not in self.summary["techniques"][phase][tag]:
+            self.summary["techniques"][phase][tag]["writeups"] = []
+          self.summary["techniques"][phase][tag]["writeups"].append({
+            "status": metadata["status"],
+            "datetime": metadata["datetime"],
+            "name": metadata["name"],
+            "url": metadata["url"],
+            "infra": metadata["infra"],
+            "points": metadata["points"],
+            "tags": metadata["tags"],
+            "verbose_id": verbose_id,
+            "writeup": writeuppdfurl,
+            "overview": '<img src="%s" width="100" height="100" />' % (killchainurl),
+          })
 
-  def opcode_summarize(self):
-    metadict = utils.load_yaml(self.config["metayml"])
+    for port, l4, proto, service in facts["ports"]:
+      pl4 = "%s/%s" % (port, l4)
+      if pl4 in self.summary["plot"]["ports"]:
+        self.summary["plot"]["ports"][pl4] += 1
+      else:
+        self.summary["plot"]["ports"][pl4] = 1
+
+      if proto:
+        if proto in self.summary["plot"]["protocols"]:
+          self.summary["plot"]["protocols"][proto] += 1
+        else:
+          self.summary["plot"]["protocols"][proto] = 1
+
+      if service:
+        if service in self.summary["plot"]["services"]:
+          self.summary["plot"]["services"][service] += 1
+        else:
+          self.summary["plot"]["services"][service] = 1
+
+    for cat in metadata["categories"]:
+      if cat in self.summary["plot"]["categories"]:
+        self.summary["plot"]["categories"][cat] += 1
+      else:
+        self.summary["plot"]["categories"][cat] = 1
+
+    for tag in metadata["tags"]:
+      if tag in self.summary["plot"]["ttps"]:
+        self.summary["plot"]["ttps"][tag] += 1
+      else:
+        self.summary["plot"]["ttps"][tag] = 1
+
+    self.summary["readme"].append({
+      "status": metadata["status"],
+      "datetime": metadata["datetime"],
+      "name": metadata["name"],
+      "url": metadata["url"],
+      "infra": metadata["infra"],
+      "points": metadata["points"],
+      "tags": metadata["tags"],
+      "writeup": writeuppdfurl,
+      "overview": '<img src="%s" width="100" height="100" />' % (killchainurl),
+      "machine": machine,
+    })
+
+    self.merge_writeup_ttps(facts, {"name": metadata["name"], "verbose_id": machine["verbose_id"], "url": writeuppdfurl})
+
+    self.loot.add_facts(facts["loot"], metadata["path"])
+
+    # collect writeup tags/ttps for machine entries in machines.json, written once after all writeups are processed
+    ttps = {
+      "enumerate": [],
+      "exploit": [],
+      "privesc": [],
+    }
+    for tag in metadata["tags"]:
+      if tag.startswith("enumerate_"): ttps["enumerate"].append(tag)
+      if tag.startswith("exploit_"): ttps["exploit"].append(tag)
+      if tag.startswith("privesc_"): ttps["privesc"].append(tag)
+    ttpannotations[metadata["url"]] = {"ttps": ttps}
+
+  def merge_writeup_ttps(self, facts, writeup):
+    # ttpsitw/protokeys are sets here, merge_technique_ports() sorts each port once after all writeups are merged
+    for port, l4, protokey, ttpsitw in facts["ttpsitw"]:
+      if port not in self.summary["ttpsitw"]:
+        self.summary["ttpsitw"][port] = {
+          "port": port,
+          "l4": l4,
+          "ttps": {},
+          "ttpsitw": set(),
+          "protokeys": set(),
+          "writeups": [],
+        }
+      self.summary["ttpsitw"][port]["ttpsitw"].update(ttpsitw)
+      if protokey:
+        self.summary["ttpsitw"][port]["protokeys"].add(protokey)
+      self.summary["ttpsitw"][port]["writeups"].append(writeup)
+
+  def merge_technique_ports(self):
+    # ttps are accumulated as ordered dict keys and ttpsitw/protokeys as sets, each port is sorted once below
+    for phase in ["enumerate", "exploit", "privesc"]:
+      for ttp in self.summary["techniques"][phase]:
+        for port in self.summary["techniques"][phase][ttp].get("ports") or []:
+          if not port:
+            continue
+          port, l4 = port.split("/")
+          if port not in self.summary["ttpsitw"]:
+            self.summary["ttpsitw"][port] = {
+              "port": port,
+              "l4": l4,
+              "ttps": {},
+              "ttpsitw": set(),
+              "protokeys": set(),
+              "writeups": [],
+            }
+          self.summary["ttpsitw"][port]["ttps"][ttp] = None
+    for port in self.summary["ttpsitw"]:
+      self.summary["ttpsitw"][port]["ttps"] = list(self.summary["ttpsitw"][port]["ttps"])
+      self.summary["ttpsitw"][port]["ttpsitw"] = utils.sorted_casefold(self.summary["ttpsitw"][port]["ttpsitw"])
+      self.summary["ttpsitw"][port]["protokeys"] = utils.sorted_casefold(self.summary["ttpsitw"][port]["protokeys"])
+
+  def init_summary(self, metadict):
     self.summary = {
       "stats": {
         "counts": "",
@@ -361,77 +876,60 @@ class Svachal:
       "methodology": metadict["meta"]["methodology"],
     }
 
+  def opcode_summarize(self):
+    metadict = utils.load_yaml(self.config["metayml"])
+    self.init_summary(metadict)
+
     for key in self.machinesstats["counts"]:
       self.summary["counts"][key] = self.machinesstats["counts"][key]
 
-    writeupdirs = [x.replace("/writeup.yml", "").split("/")[-1] for x in utils.search_files_yml(self.config["writeupdir"])]
-    total, private, machines = len(writeupdirs), [], []
-    for idx, wd in enumerate(sorted(writeupdirs, key=str.casefold)):
-      destdirpath = "%s/%s" % (self.config["writeupdir"], wd)
-      writeupyml = "%s/writeup.yml" % (destdirpath)
-      print("%s summarizing '%s'" % (utils.blue_bold("(%03d/%03d)" % (idx+1, total)), writeupyml))
-      dictyml = utils.load_yaml(writeupyml)
-
-      writeupmdurl = "%s/blob/master/%s/writeup.md" % (self.config["githubrepourl"], dictyml["writeup"]["metadata"]["path"])
-      writeuppdfurl = "%s/blob/master/%s/writeup.pdf" % (self.config["githubrepourl"], dictyml["writeup"]["metadata"]["path"])
-      killchainurl = "%s/blob/master/%s/killchain.png" % (self.config["githubrepourl"], dictyml["writeup"]["metadata"]["path"])
-
-      dictyml["writeup"]["machine"] = {}
-      query = '.machines[] | select(.url == "%s")' % (dictyml["writeup"]["metadata"]["url"])
-      result = self._json_query(query)
-      if result and len(result) == 1:
-        machinestats = result[0]
-      else:
-        machinestats = {
-          "name": dictyml["writeup"]["metadata"]["name"],
-          "url": dictyml["writeup"]["metadata"]["url"],
-        }
-      dictyml["writeup"]["machine"] = machinestats
-      dictyml["writeup"]["machine"]["writeupmdurl"] = writeupmdurl
-      dictyml["writeup"]["machine"]["writeuppdfurl"] = writeuppdfurl
-      dictyml["writeup"]["machine"]["killchainurl"] = killchainurl
-      dictyml["writeup"]["machine"]["verbose_id"] = machinestats["verbose_id"] if "verbose_id" in machinestats else "%s#%s" % (dictyml["writeup"]["metadata"]["infra"].lower().strip(), dictyml["writeup"]["metadata"]["name"].replace(" ", "").lower().strip())
-      if "oscplike" in machinestats:
-        dictyml["writeup"]["machine"]["oscplike"] = machinestats["oscplike"]
-      elif "oscp" in dictyml["writeup"]["metadata"]["categories"]:
-        dictyml["writeup"]["machine"]["oscplike"] = True
-      else:
-        dictyml["writeup"]["machine"]["oscplike"] = False
-      dictyml["writeup"]["machine"]["os"] = machinestats["os"] if "os" in machinestats else None
-      dictyml["writeup"]["machine"]["private"] = True if dictyml["writeup"]["metadata"]["status"].lower().strip() == "private" else False
-      dictyml["writeup"]["machine"]["owned_user"] = True if dictyml["writeup"]["metadata"]["status"].lower().strip() == "public" else False
-      dictyml["writeup"]["machine"]["owned_root"] = True if dictyml["writeup"]["metadata"]["status"].lower().strip() == "public" else False
-      if dictyml["writeup"]["machine"].get("difficulty_ratings") and dictyml["writeup"]["machine"]["difficulty_ratings"]:
-        dictyml["writeup"]["machine"]["ratingsurl"] = "%s/blob/master/%s/ratings.png" % (self.config["githubrepourl"], dictyml["writeup"]["metadata"]["path"])
-        dictyml["writeup"]["machine"]["matrixurl"] = "%s/blob/master/%s/matrix.png" % (self.config["githubrepourl"], dictyml["writeup"]["metadata"]["path"])
-      else:
-        dictyml["writeup"]["machine"]["ratingsurl"] = None
-        dictyml["writeup"]["machine"]["matrixurl"] = None
-
-      machines.append(dictyml["writeup"]["machine"])
-
-      if dictyml["writeup"]["metadata"]["status"].lower().strip() == "private":
-        private.append(dictyml)
+    writeups = utils.search_writeups(self.config["writeupdir"])
+    total, private, machines, ttpannotations = len(writeups), [], [], {}
+    self.loot = loot.Loot()
+    factscache = utils.load_json(self.config["factsjson"]) if os.path.isfile(self.config["factsjson"]) else {}
+    if factscache.get("version") != self.config["factsversion"]:
+      factscache = {"version": self.config["factsversion"], "writeups": {}}
+    cachedfacts, pending = {}, {}
+    for idx, writeup in enumerate(writeups):
+      wd = writeup.name
+      cached = factscache["writeups"].get(wd)
+      if cached and (cached["mtime"], cached["size"]) == (writeup.mtime, writeup.size):
+        cachedfacts[wd] = cached
         continue
-
-      if ("vulnhub" in dictyml["writeup"]["metadata"]["categories"] or "vh" in dictyml["writeup"]["metadata"]["categories"]) and "linux" in dictyml["writeup"]["metadata"]["categories"]:
-        self.summary["counts"]["writeupsvh"] += 1
-        self.summary["counts"]["writeupsnix"] += 1
-      if ("vulnhub" in dictyml["writeup"]["metadata"]["categories"] or "vh" in dictyml["writeup"]["metadata"]["categories"]) and "windows" in dictyml["writeup"]["metadata"]["categories"]:
-        self.summary["counts"]["writeupsvh"] += 1
-        self.summary["counts"]["writeupswindows"] += 1
-      if ("hackthebox" in dictyml["writeup"]["metadata"]["categories"] or "htb" in dictyml["writeup"]["metadata"]["categories"]) and "linux" in dictyml["writeup"]["metadata"]["categories"]:
-        self.summary["counts"]["writeupshtb"] += 1
-        self.summary["counts"]["writeupsnix"] += 1
-      if ("hackthebox" in dictyml["writeup"]["metadata"]["categories"] or "htb" in dictyml["writeup"]["metadata"]["categories"]) and "windows" in dictyml["writeup"]["metadata"]["categories"]:
-        self.summary["counts"]["writeupshtb"] += 1
-        self.summary["counts"]["writeupswindows"] += 1
-      if ("tryhackme" in dictyml["writeup"]["metadata"]["categories"] or "thm" in dictyml["writeup"]["metadata"]["categories"]) and "linux" in dictyml["writeup"]["metadata"]["categories"]:
-        self.summary["counts"]["writeupsthm"] += 1
-        self.summary["counts"]["writeupsnix"] += 1
-      if ("tryhackme" in dictyml["writeup"]["metadata"]["categories"] or "thm" in dictyml["writeup"]["metadata"]["categories"]) and "windows" in dictyml["writeup"]["metadata"]["categories"]:
-        self.summary["counts"]["writeupsthm"] += 1
-        self.summary["counts"]["writeupswindows"] += 1
+      sha256 = utils.file_sha256(writeup.ymlpath)
+      if cached and cached["sha256"] == sha256:
+        cachedfacts[wd] = {"mtime": writeup.mtime, "size": writeup.size, "sha256": sha256, "facts": cached["facts"]}
+        continue
+      cachedfacts[wd] = {"mtime": writeup.mtime, "size": writeup.size, "sha256": sha256, "facts": None}
+      pending[wd] = (idx, writeup.ymlpath)
+
+    # map: extract facts for new/changed writeups, in parallel if requested
+    if self.config["jobs"] > 1 and len(pending) > 1:
+      import concurrent.futures
+      with concurrent.futures.ProcessPoolExecutor(max_workers=self.config["jobs"]) as executor:
+        futures = {executor.submit(extract_writeup_facts, pending[wd][1]): wd for wd in pending}
+        for future in concurrent.futures.as_completed(futures):
+          wd = futures[future]
+          print("%s summarizing '%s'" % (utils.blue_bold("(%03d/%03d)" % (pending[wd][0]+1, total)), pending[wd][1]))
+          cachedfacts[wd]["facts"] = future.result()
+    else:
+      for wd in pending:
+        print("%s summarizing '%s'" % (utils.blue_bold("(%03d/%03d)" % (pending[wd][0]+1, total)), pending[wd][1]))
+        cachedfacts[wd]["facts"] = extract_writeup_facts(pending[wd][1])
+
+    # reduce: always merge in sorted writeup order so output does not depend on completion order
+    for writeup in writeups:
+      self.merge_writeup_facts(cachedfacts[writeup.name]["facts"], machines, private, ttpannotations)
+    parsed = len(pending)
+    self.summary["loot"] = self.loot.to_summary()
+
+    factscache["writeups"] = cachedfacts
+    utils.mkdirp(self.config["statedir"])
+    utils.save_json(factscache, self.config["factsjson"])
+    self.loot.save(self.config["lootjson"])
+    utils.info("summarized %d writeups (parsed: %d, cached: %d)" % (total, parsed, total-parsed))
+
+    if total-len(private):
       self.summary["counts"]["writeups"] = self.summary["counts"]["writeupsvh"] + self.summary["counts"]["writeupshtb"]
       self.summary["counts"]["percent"] = "%.2f" % ((self.summary["counts"]["writeups"] / self.summary["counts"]["totaloscplike"]) * 100)
       self.summary["counts"]["percentvh"] = "%.2f" % ((self.summary["counts"]["writeupsvh"] / self.summary["counts"]["vhoscplike"]) * 100)
@@ -440,250 +938,9 @@ class Svachal:
       self.summary["counts"]["percentnix"] = "%.2f" % ((self.summary["counts"]["writeupsnix"] / self.summary["counts"]["totalnix"]) * 100)
       self.summary["counts"]["percentwindows"] = "%.2f" % ((self.summary["counts"]["writeupswindows"] / self.summary["counts"]["totalwindows"]) * 100)
 
-      # uncomment lines below if matrix.png has to be updated
-      #if machine.get("matrix"):
-      #  utils.to_sparklines(machine["difficulty_ratings"] if machine["difficulty_ratings"] else [], filename="%s/ratings.png" % (destdirpath))
-      #  url = "https://quickchart.io/chart?bkg=rgba(255,255,255,0.2)&width=270&height=200&c={ type: 'radar', data: {fill: 'False', labels: ['Enumeration', 'Real-Life', 'CVE', ['Custom', 'Exploitation'], 'CTF-Like'], datasets: [{ label: 'User rated', data: %s, backgroundColor:'rgba(154,204,20,0.2)', borderColor:'rgb(154,204,20)', pointBackgroundColor:'rgb(154,204,20)' }, { label: 'Maker rated', data: %s, backgroundColor:'rgba(86,192,224,0.2)', borderColor:'rgb(86,192,224)', pointBackgroundColor:'rgb(86,192,224)' }] }, options: { layout:{ padding:25}, plugins: { legend: false,}, scale: { angleLines: { display: true, color: 'rgb(21,23,25)' }, ticks: { callback: function() {return ''}, backdropColor: 'rgba(0, 0, 0, 0)' }, gridLines: { color: 'rgb(51,54,60)', } }, } }" % (machine["matrix"]["aggregate"], machine["matrix"]["maker"])
-      #  res = utils.get_http_res(url, requoteuri=True)
-      #  filename = "%s/matrix.png" % (destdirpath)
-      #  with open(filename, "wb") as fp:
-      #    fp.write(res.content)
-
-      for tag in dictyml["writeup"]["metadata"]["tags"]:
-        if tag.startswith("enumerate_"):
-          if None in self.summary["techniques"]["enumerate"][tag]["references"]:
-            self.summary["techniques"]["enumerate"][tag]["references"] = []
-          if "writeups" not in self.summary["techniques"]["enumerate"][tag]:
-            self.summary["techniques"]["enumerate"][tag]["writeups"] = []
-          self.summary["techniques"]["enumerate"][tag]["writeups"].append({
-            "status": dictyml["writeup"]["metadata"]["status"],
-            "datetime": dictyml["writeup"]["metadata"]["datetime"],
-            "name": dictyml["writeup"]["metadata"]["name"],
-            "url": dictyml["writeup"]["metadata"]["url"],
-            "infra": dictyml["writeup"]["metadata"]["infra"],
-            "points": dictyml["writeup"]["metadata"]["points"] if dictyml["writeup"]["metadata"].get("points") else None,
-            "tags": dictyml["writeup"]["metadata"]["tags"],
-            "writeup": writeuppdfurl,
-            "verbose_id": dictyml["writeup"]["machine"]["verbose_id"].replace("hackthebox", "htb").replace("vulnhub", "vh"),
-            "overview": '<img src="%s" width="100" height="100" />' % (killchainurl),
-          })
-        if tag.startswith("exploit_"):
-          if None in self.summary["techniques"]["exploit"][tag]["references"]:
-            self.summary["techniques"]["exploit"][tag]["references"] = []
-          if "writeups" not in self.summary["techniques"]["exploit"][tag]:
-            self.summary["techniques"]["exploit"][tag]["writeups"] = []
-          self.summary["techniques"]["exploit"][tag]["writeups"].append({
-            "status": dictyml["writeup"]["metadata"]["status"],
-            "datetime": dictyml["writeup"]["metadata"]["datetime"],
-            "name": dictyml["writeup"]["metadata"]["name"],
-            "url": dictyml["writeup"]["metadata"]["url"],
-            "infra": dictyml["writeup"]["metadata"]["infra"],
-            "points": dictyml["writeup"]["metadata"]["points"] if dictyml["writeup"]["metadata"].get("points") else None,
-            "tags": dictyml["writeup"]["metadata"]["tags"],
-            "verbose_id": dictyml["writeup"]["machine"]["verbose_id"].replace("hackthebox", "htb").replace("vulnhub", "vh"),
-            "writeup": writeuppdfurl,
-            "overview": '<img src="%s" width="100" height="100" />' % (killchainurl if dictyml["writeup"].get("overview") else killchainurl),
-          })
-        if tag.startswith("privesc_"):
-          if None in self.summary["techniques"]["privesc"][tag]["references"]:
-            self.summary["techniques"]["privesc"][tag]["references"] = []
-          if "writeups" not in self.summary["techniques"]["privesc"][tag]:
-            self.summary["techniques"]["privesc"][tag]["writeups"] = []
-          self.summary["techniques"]["privesc"][tag]["writeups"].append({
-            "status": dictyml["writeup"]["metadata"]["status"],
-            "datetime": dictyml["writeup"]["metadata"]["datetime"],
-            "name": dictyml["writeup"]["metadata"]["name"],
-            "url": dictyml["writeup"]["metadata"]["url"],
-            "infra": dictyml["writeup"]["metadata"]["infra"],
-            "points": dictyml["writeup"]["metadata"]["points"] if dictyml["writeup"]["metadata"].get("points") else None,
-            "tags": dictyml["writeup"]["metadata"]["tags"],
-            "verbose_id": dictyml["writeup"]["machine"]["verbose_id"].replace("hackthebox", "htb").replace("vulnhub", "vh"),
-            "writeup": writeuppdfurl,
-            "overview": '<img src="%s" width="100" height="100" />' % (killchainurl if dictyml["writeup"].get("overview") else killchainurl),
-          })
-
-      if dictyml["writeup"]["overview"].get("ttps"):
-        for protokey in dictyml["writeup"]["overview"]["ttps"]:
-          port, l4, proto, service = None, None, None, None
-          try:
-            port, l4, proto, service = protokey.split("/", 3)
-          except:
-            try:
-              port, l4, proto = protokey.split("/", 2)
-            except:
-              port, l4 = protokey.split("/", 1)
-
-          pl4 = "%s/%s" % (port, l4)
-          if pl4 in self.summary["plot"]["ports"]:
-            self.summary["plot"]["ports"][pl4] += 1
-          else:
-            self.summary["plot"]["ports"][pl4] = 1
-
-          if proto:
-            if proto in self.summary["plot"]["protocols"]:
-              self.summary["plot"]["protocols"][proto] += 1
-            else:
-              self.summary["plot"]["protocols"][proto] = 1
-
-          if service:
-            if service in self.summary["plot"]["services"]:
-              self.summary["plot"]["services"][service] += 1
-            else:
-              self.summary["plot"]["services"][service] = 1
-
-      for cat in dictyml["writeup"]["metadata"]["categories"]:
-        if cat in self.summary["plot"]["categories"]:
-          self.summary["plot"]["categories"][cat] += 1
-        else:
-          self.summary["plot"]["categories"][cat] = 1
-
-      for tag in dictyml["writeup"]["metadata"]["tags"]:
-        if tag in self.summary["plot"]["ttps"]:
-          self.summary["plot"]["ttps"][tag] += 1
-        else:
-          self.summary["plot"]["ttps"][tag] = 1
-
-      self.summary["readme"].append({
-        "status": dictyml["writeup"]["metadata"]["status"],
-        "datetime": dictyml["writeup"]["metadata"]["datetime"],
-        "name": dictyml["writeup"]["metadata"]["name"],
-        "url": dictyml["writeup"]["metadata"]["url"],
-        "infra": dictyml["writeup"]["metadata"]["infra"],
-        "points": dictyml["writeup"]["metadata"]["points"] if dictyml["writeup"]["metadata"].get("points") else None,
-        "tags": dictyml["writeup"]["metadata"]["tags"],
-        "writeup": writeuppdfurl,
-        "overview": '<img src="%s" width="100" height="100" />' % (killchainurl if dictyml["writeup"].get("overview") else killchainurl),
-        "machine": dictyml["writeup"]["machine"],
-      })
-
-      if dictyml["writeup"]["overview"].get("ttps"):
-        for protokey in dictyml["writeup"]["overview"]["ttps"]:
-          port, l4, proto, service = None, None, None, None
-          try:
-            port, l4, proto, service = protokey.split("/", 3)
-          except:
-            try:
-              port, l4, proto = protokey.split("/", 2)
-            except:
-              port, l4 = protokey.split("/", 1)
-          ttpsitw = dictyml["writeup"]["overview"]["ttps"][protokey].split(" ")
-
-          protokey = "/".join(protokey.split("/")[2:])
-          if protokey == "":
-            protokey = None
-
-          if port not in self.summary["ttpsitw"]:
-            self.summary["ttpsitw"][port] = {
-              "port": port,
-              "l4": l4,
-              "ttps": [],
-              "ttpsitw": ttpsitw,
-              "protokeys": [protokey] if protokey else [],
-              "writeups": [{"name": dictyml["writeup"]["metadata"]["name"], "verbose_id": dictyml["writeup"]["machine"]["verbose_id"], "url": writeuppdfurl}] if dictyml["writeup"]["machine"] else [],
-            }
-          else:
-            self.summary["ttpsitw"][port]["ttpsitw"].extend(ttpsitw)
-            if protokey:
-              self.summary["ttpsitw"][port]["protokeys"].append(protokey)
-            self.summary["ttpsitw"][port]["writeups"].append({"name": dictyml["writeup"]["metadata"]["name"], "verbose_id": dictyml["writeup"]["machine"]["verbose_id"], "url": writeuppdfurl})
-
-          self.summary["ttpsitw"][port]["ttpsitw"] = sorted(list(set(self.summary["ttpsitw"][port]["ttpsitw"])), key=str.casefold)
-          self.summary["ttpsitw"][port]["protokeys"] = sorted(list(set(self.summary["ttpsitw"][port]["protokeys"])), key=str.casefold)
-
-      loot = []
-      if dictyml["writeup"].get("loot") and dictyml["writeup"]["loot"].get("credentials"):
-        for credtype in dictyml["writeup"]["loot"]["credentials"]:
-          for entry in dictyml["writeup"]["loot"]["credentials"][credtype]:
-            try:
-              username, password = entry.split("/", 1)
-            except:
-              username, password = None, entry
-            uniqkey = "%s,%s,%s" % (username, password, credtype)
-            if uniqkey not in loot:
-              self.summary["loot"]["credentials"].append({
-                "username": username,
-                "password": password,
-                "credtype": credtype,
-              })
-              loot.append(uniqkey)
-
-      if dictyml["writeup"].get("loot") and dictyml["writeup"]["loot"].get("hashes"):
-        self.summary["loot"]["hashes"].extend([x for x in dictyml["writeup"]["loot"]["hashes"]])
-      self.summary["loot"]["hashes"] = sorted(list(set(self.summary["loot"]["hashes"])), key=str.casefold)
-
-      # add writeup tags/ttps to machine entries in machines.json
-      ttpmachines = []
-      for machine in self.machinesstats["machines"]:
-        entry = machine
-        if entry["url"] == dictyml["writeup"]["metadata"]["url"]:
-          if not entry.get("writeups"):
-            entry["writeups"] = {}
-          entry["writeups"]["7h3rAm"] = {
-            "ttps": {
-              "enumerate": [],
-              "exploit": [],
-              "privesc": [],
-            }
-          }
-          for tag in dictyml["writeup"]["metadata"]["tags"]:
-            if tag.startswith("enumerate_"): entry["writeups"]["7h3rAm"]["ttps"]["enumerate"].append(tag)
-            if tag.startswith("exploit_"): entry["writeups"]["7h3rAm"]["ttps"]["exploit"].append(tag)
-            if tag.startswith("privesc_"): entry["writeups"]["7h3rAm"]["ttps"]["privesc"].append(tag)
-        ttpmachines.append(entry)
-      self.machinesstats["machines"] = ttpmachines
-      utils.save_json(self.machinesstats, self.config["machinesjson"])
+    self.update_machines_ttps(ttpannotations)
 
-    for ttp in self.summary["techniques"]["enumerate"]:
-      if self.summary["techniques"]["enumerate"][ttp].get("ports"):
-        for port in self.summary["techniques"]["enumerate"][ttp]["ports"]:
-          if not port:
-            continue
-          port, l4 = port.split("/")
-          if port not in self.summary["ttpsitw"]:
-            self.summary["ttpsitw"][port] = {
-              "port": port,
-              "l4": l4,
-              "ttps": [ttp],
-              "ttpsitw": [],
-              "protokeys": [],
-              "writeups": [],
-            }
-          elif ttp not in self.summary["ttpsitw"][port]["ttps"]:
-            self.summary["ttpsitw"][port]["ttps"].append(ttp)
-    for ttp in self.summary["techniques"]["exploit"]:
-      if self.summary["techniques"]["exploit"][ttp].get("ports"):
-        for port in self.summary["techniques"]["exploit"][ttp]["ports"]:
-          if not port:
-            continue
-          port, l4 = port.split("/")
-          if port not in self.summary["ttpsitw"]:
-            self.summary["ttpsitw"][port] = {
-              "port": port,
-              "l4": l4,
-              "ttps": [ttp],
-              "ttpsitw": [],
-              "protokeys": [],
-              "writeups": [],
-            }
-          elif ttp not in self.summary["ttpsitw"][port]["ttps"]:
-            self.summary["ttpsitw"][port]["ttps"].append(ttp)
-    for ttp in self.summary["techniques"]["privesc"]:
-      if self.summary["techniques"]["privesc"][ttp].get("ports"):
-        for port in self.summary["techniques"]["privesc"][ttp]["ports"]:
-          if not port:
-            continue
-          port, l4 = port.split("/")
-          if port not in self.summary["ttpsitw"]:
-            self.summary["ttpsitw"][port] = {
-              "port": port,
-              "l4": l4,
-              "ttps": [ttp],
-              "ttpsitw": [],
-              "protokeys": [],
-              "writeups": [],
-            }
-          elif ttp not in self.summary["ttpsitw"][port]["ttps"]:
-            self.summary["ttpsitw"][port]["ttps"].append(ttp)
+    self.merge_technique_ports()
 
     utils.show_machines(machines)
 
@@ -705,49 +962,115 @@ class Svachal:
     utils.info("updated %s with %d port-ttps mappings" % (self.config["ttpscsv"], len(ttpitwcsv)))
 
     utils.file_save(self.config["summaryyml"], utils.dict2yaml({"summary": self.summary}))
-    utils.info("updated %s for %d writeups (private: %d)" % (self.config["summaryyml"], total-len(private), len(private)))
+    utils.info("updated %s for %d writeups (private: %d, yaml: %s)" % (self.config["summaryyml"], total-len(private), len(private), utils.yaml_backend()))
 
     self.yml2md(ymlfile=self.config["summaryyml"], templatefile="template.readme.md", templatedir=self.config["templatedir"], destdir=self.config["writeupdir"], destfile="readme.md")
     utils.info("updated %s/readme.md with new stats and metadata" % (self.config["writeupdir"]))
 
+  def opcode_loot(self, needle):
+    if not os.path.isfile(self.config["lootjson"]):
+      utils.error("no loot index at %s, run with --summarize first" % (self.config["lootjson"]))
+      return
+    matches = loot.Loot.load(self.config["lootjson"]).lookup(needle)
+    if not matches:
+      utils.warn("no loot matching '%s'" % (needle))
+      return
+    header, rows = ["#", "Type", "Username", "Loot", "Credtype", "Writeups"], []
+    for idx, (kind, username, value, credtype, writeups) in enumerate(matches):
+      rows.append([str(idx+1), kind, username or "", str(value), credtype or "", "\n".join(writeups)])
+    utils.to_table(header, rows, aligndict={"#": "r", "Type": "l", "Username": "l", "Loot": "l", "Credtype": "l", "Writeups": "l"}, multiline=True)
+
+  def opcode_graph(self, minweight=1):
+    writeups = utils.search_writeups(self.config["writeupdir"])
+    if self.config["jobs"] > 1 and len(writeups) > 1:
+      import concurrent.futures
+      with concurrent.futures.ProcessPoolExecutor(max_workers=self.config["jobs"]) as executor:
+        killchains = list(executor.map(extract_killchain, [x.ymlpath for x in writeups], chunksize=max(1, len(writeups)//(self.config["jobs"]*4))))
+    else:
+      killchains = [extract_killchain(x.ymlpath) for x in writeups]
+
+    graph = yml2dot.AttackGraph(fontsize="medium")
+    for killchain in killchains:
+      if killchain:
+        graph.add(killchain)
+    pngfile = graph.save(self.config["attackgraphdot"], minweight=max(1, minweight), title="svachal attack graph")
+    utils.info("updated %s from %d killchains (nodes: %d, edges: %d, min weight: %d)" % (pngfile, graph.writeups, len(graph.nodelabels), len(graph.edgeweights), max(1, minweight)))
+
+  def opcode_query(self, filters, jsonify=False):
+    parsed = []
+    for item in filters:
+      if "=" not in item:
+        utils.error("invalid query filter '%s', expected key=value" % (item))
+        return
+      key, value = item.split("=", 1)
+      parsed.append((key.strip().lower(), value.strip()))
+
+    machinesmtime = os.stat(self.config["machinesjson"]).st_mtime_ns if os.path.isfile(self.config["machinesjson"]) else None
+    db = catalog.Catalog(self.config["catalogdb"])
+    try:
+      updated, removed = db.sync(utils.search_writeups(self.config["writeupdir"]), extract_writeup_facts, lambda url: self.machine_lookup(url=url) if machinesmtime else None, machinesmtime=machinesmtime)
+      # json output stays parseable, status lines are only shown for the table
+      if (updated or removed) and not jsonify:
+        utils.info("updated %s (cataloged: %d, removed: %d)" % (self.config["catalogdb"], updated, removed))
+      try:
+        results = db.query(parsed)
+      except ValueError as ex:
+        utils.error(str(ex))
+        return
+    finally:
+      db.close()
+
+    if jsonify:
+      utils.to_json(results)
+    elif not results:
+      utils.warn("no writeups matching '%s'" % (" ".join(filters)))
+    else:
+      header, rows = ["#", "Name", "Infra", "OS", "Status", "Ports", "Tags"], []
+      for idx, entry in enumerate(results):
+        rows.append([str(idx+1), entry["name"], entry["infra"], entry["os"] or "", entry["status"], "\n".join(entry["ports"]), "\n".join(entry["tags"])])
+      utils.to_table(header, rows, aligndict={"#": "r", "Name": "l", "Infra": "l", "OS": "c", "Status": "c", "Ports": "l", "Tags": "l"}, multiline=True)
+
   def stats_counts(self):
     header, rows = ["#", "TryHackMe", "HackTheBox", "VulnHub", "OSCPlike", "Owned"], []
-    rows.append("___".join([x for x in [
+    rows.append([x for x in [
       "%s" % ("Total"),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedthm"], self.summary["counts"]["totalthm"], "%.2f%%" % (self.summary["counts"]["perthm"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedhtb"], self.summary["counts"]["totalhtb"], "%.2f%%" % (self.summary["counts"]["perhtb"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedvh"], self.summary["counts"]["totalvh"], "%.2f%%" % (self.summary["counts"]["pervh"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedoscplike"], self.summary["counts"]["totaloscplike"], "%.2f%%" % (self.summary["counts"]["peroscplike"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedtotal"], self.summary["counts"]["totaltotal"], "%.2f%%" % (self.summary["counts"]["pertotal"])),
-    ]]))
-    rows.append("___".join([str(x) for x in [
+    ]])
+    rows.append([str(x) for x in [
       "Windows",
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedthmwindows"], self.summary["counts"]["thmwindows"], "%.2f%%" % (self.summary["counts"]["perthmwindows"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedhtbwindows"], self.summary["counts"]["htbwindows"], "%.2f%%" % (self.summary["counts"]["perhtbwindows"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedvhwindows"], self.summary["counts"]["vhwindows"], "%.2f%%" % (self.summary["counts"]["pervhwindows"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedoscplikewindows"], self.summary["counts"]["oscplikewindows"], "%.2f%%" % (self.summary["counts"]["peroscplikewindows"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedwindows"], self.summary["counts"]["totalwindows"], "%.2f%%" % (self.summary["counts"]["perwindows"])),
-    ]]))
-    rows.append("___".join([str(x) for x in [
+    ]])
+    rows.append([str(x) for x in [
       "*nix",
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedthmnix"], self.summary["counts"]["thmnix"], "%.2f%%" % (self.summary["counts"]["perthmnix"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedhtbnix"], self.summary["counts"]["htbnix"], "%.2f%%" % (self.summary["counts"]["perhtbnix"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedvhnix"], self.summary["counts"]["vhnix"], "%.2f%%" % (self.summary["counts"]["pervhnix"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedoscplikenix"], self.summary["counts"]["oscplikenix"], "%.2f%%" % (self.summary["counts"]["peroscplikenix"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownednix"], self.summary["counts"]["totalnix"], "%.2f%%" % (self.summary["counts"]["pernix"])),
-    ]]))
-    rows.append("___".join([str(x) for x in [
+    ]])
+    rows.append([str(x) for x in [
       "OSCPlike",
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedthmoscplike"], self.summary["counts"]["thmoscplike"], "%.2f%%" % (self.summary["counts"]["perthmoscplike"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedhtboscplike"], self.summary["counts"]["htboscplike"], "%.2f%%" % (self.summary["counts"]["perhtboscplike"])),
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedvhoscplike"], self.summary["counts"]["vhoscplike"], "%.2f%%" % (self.summary["counts"]["pervhoscplike"])),
       "",
       "`%s/%s (%s)`" % (self.summary["counts"]["ownedoscplike"], self.summary["counts"]["totaloscplike"], "%.2f%%" % (self.summary["counts"]["peroscplike"])),
-    ]]))
-    return utils.get_table(header, rows, delim="___", markdown=True, colalign="center")
+    ]])
+    return utils.get_table(header, rows, markdown=True, colalign="center")
 
   def stats_owned(self, machines):
     header, rows = ["#", "Name", "Infra", "Killchain", "TTPs"], []
+    # url -> writeup lookup built once (last writeup for a url wins, as with the previous linear scan)
+    writeups = {writeup["url"]: writeup for writeup in self.summary["readme"]}
+    tagcells = {}
     for machine in machines:
       if machine["owned_user"] or machine["owned_root"]:
         os = utils.to_emoji(machine["os"])
@@ -764,38 +1087,125 @@ class Svachal:
           oscplike, oscplike_tooltip = utils.to_emoji("notoscplike"), "!= oscplike"
         name = "[%s](%s#machines)" % (self.config["githubrepourl"], machine["name"])
         infra = "[%s](%s)" % (machine["verbose_id"].replace("hackthebox", "htb").replace("vulnhub", "vh"), machine["url"])
-        tags, matrix, rating, writeuppdfurl, killchainurl = [], None, None, None, ""
-        for writeup in self.summary["readme"]:
-          if machine["url"] == writeup["url"]:
-            tags = writeup["tags"]
-            matrix = '<img src="%s" width="59" height="59"/>' % (machine["matrixurl"]) if machine["matrixurl"] else None
-            rating = '<img src="%s" width="59" height="20"/>' % (machine["ratingsurl"]) if machine["ratingsurl"] else None
-            writeuppdfurl = machine["writeuppdfurl"]
-            killchainurl = '<img src="%s" width="100" height="100"/>' % (machine["killchainurl"])
-            if machine["matrixurl"] and machine["ratingsurl"]:
-              name = "[%s](%s)<br/>%s<br/>%s" % (machine["name"], writeuppdfurl, '<img src="%s" width="59" height="59"/>' % (machine["matrixurl"]) if machine["matrixurl"] else "", '<img src="%s" width="59" height="20"/>' % (machine["ratingsurl"]) if machine["ratingsurl"] else "")
-            elif machine["matrixurl"]:
-              name = "[%s](%s)<br/>%s" % (machine["name"], writeuppdfurl, '<img src="%s" width="59" height="59"/>' % (machine["matrixurl"]) if machine["matrixurl"] else "")
-            elif machine["ratingsurl"]:
-              name = "[%s](%s)<br/>%s" % (machine["name"], writeuppdfurl, '<img src="%s" width="59" height="20"/>' % (machine["ratingsurl"]) if machine["ratingsurl"] else "")
-            else:
-              name = "[%s](%s)" % (machine["name"], writeuppdfurl)
+        tags, killchainurl = "", ""
+        if machine["url"] in writeups:
+          if machine["url"] not in tagcells:
+            tagcells[machine["url"]] = utils.anchorformat(writeups[machine["url"]]["tags"], self.config["githubrepourl"])
+          tags = tagcells[machine["url"]]
+          killchainurl = '<img src="%s" width="100" height="100"/>' % (machine["killchainurl"])
+          images = []
+          if machine["matrixurl"]:
+            images.append('<img src="%s" width="59" height="59"/>' % (machine["matrixurl"]))
+          if machine["ratingsurl"]:
+            images.append('<img src="%s" width="59" height="20"/>' % (machine["ratingsurl"]))
+          name = "<br/>".join(["[%s](%s)" % (machine["name"], machine["writeuppdfurl"])] + images)
         emptycols = [os, difficulty, owned, oscplike]
         os = "" if os == "" else '[`%s`](foo "%s")' % (os, machine["os"])
         difficulty = "" if difficulty == "" else '[`%s`](foo %s)' % (difficulty, '"%spts"' % (machine["points"]) if machine["points"] else "!= pts")
         owned = "" if owned == "" else '[`%s`](foo "%s")' % (owned, owned_tooltip)
         oscplike = "" if oscplike == "" else '[`%s`](foo "%s")' % (oscplike, oscplike_tooltip)
-        rows.append("___".join(str(x) for x in [
+        rows.append([str(x) for x in [
           name,
           infra,
           killchainurl,
-          utils.anchorformat(tags, self.config["githubrepourl"]),
+          tags,
           #os,
           #difficulty,
           #owned,
           #oscplike,
-        ]))
-    return(utils.get_table(header, ["%d.___%s" % (idx+1, x) for idx, x in enumerate(sorted(rows, key=str.casefold))], delim="___", markdown=True, colalign="center"))
+        ]])
+    # sorted on the joined row text, same order as the delimited rows had
+    rows.sort(key=lambda row: "___".join(row).casefold())
+    return(utils.get_table(header, [["%d." % (idx+1)] + row for idx, row in enumerate(rows)], markdown=True, colalign="center"))
+
+
+def extract_writeup_facts(writeupyml):
+  # everything --summarize needs from a single writeup.yml, kept json serializable so it can be cached
+  dictyml = utils.load_yaml(writeupyml)
+  metadata = dictyml["writeup"]["metadata"]
+  facts = {
+    "metadata": {
+      "status": metadata["status"],
+      "datetime": metadata["datetime"],
+      "name": metadata["name"],
+      "url": metadata["url"],
+      "infra": metadata["infra"],
+      "points": metadata["points"] if metadata.get("points") else None,
+      "path": metadata["path"],
+      "tags": metadata["tags"],
+      "categories": metadata["categories"],
+    },
+    "private": True if metadata["status"].lower().strip() == "private" else False,
+    "counts": {},
+    "ports": [],
+    "ttpsitw": [],
+    "loot": {
+      "credentials": [],
+      "hashes": [],
+    },
+  }
+  if facts["private"]:
+    return facts
+
+  counts = {"writeupsvh": 0, "writeupshtb": 0, "writeupsthm": 0, "writeupsnix": 0, "writeupswindows": 0}
+  for infra, names in [("vh", ["vulnhub", "vh"]), ("htb", ["hackthebox", "htb"]), ("thm", ["tryhackme", "thm"])]:
+    if names[0] in metadata["categories"] or names[1] in metadata["categories"]:
+      if "linux" in metadata["categories"]:
+        counts["writeups%s" % (infra)] += 1
+        counts["writeupsnix"] += 1
+      if "windows" in metadata["categories"]:
+        counts["writeups%s" % (infra)] += 1
+        counts["writeupswindows"] += 1
+  facts["counts"] = counts
+
+  if dictyml["writeup"]["overview"].get("ttps"):
+    for protokey in dictyml["writeup"]["overview"]["ttps"]:
+      port, l4, proto, service = utils.parse_protokey(protokey)
+      facts["ports"].append([port, l4, proto, service])
+      ttpsitw = dictyml["writeup"]["overview"]["ttps"][protokey].split(" ")
+      protokey = "/".join(protokey.split("/")[2:])
+      facts["ttpsitw"].append([port, l4, protokey if protokey != "" else None, ttpsitw])
+
+  seen = set()
+  if dictyml["writeup"].get("loot") and dictyml["writeup"]["loot"].get("credentials"):
+    for credtype in dictyml["writeup"]["loot"]["credentials"]:
+      for entry in dictyml["writeup"]["loot"]["credentials"][credtype]:
+        try:
+          username, password = entry.split("/", 1)
+        except:
+          username, password = None, entry
+        if (username, password, credtype) not in seen:
+          facts["loot"]["credentials"].append([username, password, credtype])
+          seen.add((username, password, credtype))
+
+  if dictyml["writeup"].get("loot") and dictyml["writeup"]["loot"].get("hashes"):
+    facts["loot"]["hashes"].extend([x for x in dictyml["writeup"]["loot"]["hashes"]])
+
+  return facts
+
+def extract_killchain(writeupyml):
+  dictyml = utils.load_yaml(writeupyml)
+  if not dictyml or not dictyml.get("writeup") or dictyml["writeup"]["metadata"]["status"].lower().strip() == "private":
+    return None
+  return dictyml["writeup"]["overview"].get("killchain") if dictyml["writeup"].get("overview") else None
+
+def _plot_chart(chart):
+  return utils.to_xkcd(**chart)
+
+# per-process state for parallel rebuilds, populated by the pool initializer
+_rebuilder = None
+
+def _rebuild_init(writeupdir, githubrepourl, semaphore, pdfbackend="pandoc"):
+  global _rebuilder
+  _rebuilder = Svachal(writeupdir=writeupdir, githubrepourl=githubrepourl)
+  _rebuilder.subprocsem = semaphore
+  _rebuilder.config["pdfbackend"] = pdfbackend
+
+def _rebuild_writeup(writeupyml, destdirpath, knowndigest=None):
+  return _rebuilder.rebuild_writeup(writeupyml, destdirpath, knowndigest)
+
+def _rebuild_pdf(destdirpath):
+  return _rebuilder.render_pdf(destdirpath, "writeup.md")
 
 
 if __name__ == "__main__":
@@ -807,8 +1217,18 @@ if __name__ == "__main__":
   sfgroup.add_argument('-s', '--start', required=False, action='store', help='initiate new writeup process (provide machine url)')
   sfgroup.add_argument('-m', '--manual', required=False, action='store', help='initiate new writeup process (provide infra.name)')
   sfgroup.add_argument('-f', '--finish', required=False, action='store_true', help='wrapup writeup process for $PWD writeup directory')
-  sfgroup.add_argument('-r', '--rebuildall', required=False, action='store_true', help='rebuild all writeups (recreates md/pdf/killchain/matrix)')
+  sfgroup.add_argument('--watch', required=False, action='store_true', help='re-render $PWD writeup directory whenever writeup.yml or its screenshots change')
+  sfgroup.add_argument('-r', '--rebuildall', required=False, action='store_true', help='rebuild changed writeups (recreates md/pdf/killchain/matrix)')
   sfgroup.add_argument('-z', '--summarize', required=False, action='store_true', help='update summary.yml and readme.md with data from all writeups')
+  sfgroup.add_argument('--graph', required=False, action='store_true', help='merge killchains from all writeups into a weighted attackgraph.dot/png')
+  sfgroup.add_argument('-q', '--query', required=False, action='store', nargs='*', help='search the writeup catalog with key=value filters (tag, category, port, proto, service, ttp, loot, os, infra, status, difficulty, name)')
+  sfgroup.add_argument('-l', '--loot', required=False, action='store', help='search credentials/hashes collected by the last --summarize run')
+  parser.add_argument('-j', '--jobs', required=False, action='store', type=int, default=1, help='number of writeups to process in parallel (default: 1)')
+  parser.add_argument('--subprocs', required=False, action='store', type=int, default=None, help='max concurrent dot/xelatex subprocesses when using --jobs (default: jobs)')
+  parser.add_argument('--force', required=False, action='store_true', help='rebuild all writeups, ignoring the .svachal/manifest.json content hashes')
+  parser.add_argument('--pdfbackend', required=False, action='store', choices=['pandoc', 'fmt'], default='pandoc', help='pdf rendering: pandoc (default) or fmt (pandoc to latex, then xelatex with a cached precompiled preamble)')
+  parser.add_argument('--minweight', required=False, action='store', type=int, default=1, help='only keep --graph transitions shared by at least this many writeups (default: 1)')
+  parser.add_argument('--json', required=False, action='store_true', help='print --query results as json')
   args = parser.parse_args()
 
   if not args.writeupdir and not args.githubrepourl:
@@ -824,6 +1244,11 @@ if __name__ == "__main__":
   else:
     svl = Svachal(writeupdir=args.writeupdir, githubrepourl=args.githubrepourl)
 
+  svl.config["jobs"] = max(1, args.jobs)
+  svl.config["subprocs"] = args.subprocs
+  svl.config["force"] = args.force
+  svl.config["pdfbackend"] = args.pdfbackend
+
   if args.start:
     svl.opcode_start(args.start, manual=False)
 
@@ -833,11 +1258,23 @@ if __name__ == "__main__":
   elif args.finish:
     svl.opcode_finish()
 
+  elif args.watch:
+    svl.opcode_watch()
+
   elif args.rebuildall:
     svl.opcode_rebuildall()
 
   elif args.summarize:
     svl.opcode_summarize()
 
+  elif args.graph:
+    svl.opcode_graph(minweight=args.minweight)
+
+  elif args.query is not None:
+    svl.opcode_query(args.query, jsonify=args.json)
+
+  elif args.loot:
+    svl.opcode_loot(args.loot)
+
   else:
     parser.print_help()
@@ -6,14 +6,29 @@ import yaml
 import errno
 import codecs
 import fnmatch
+import hashlib
+import tempfile
 import datetime
-import urllib.request
+import collections
 
-import requests
-import sparkline
-import prettytable
-from bs4 import BeautifulSoup
-import matplotlib.pyplot as plt
+# requests, sparkline, bs4 and matplotlib are slow to import and only needed by a few
+# code paths, so they are imported where used to keep cli startup fast
+
+# prefer the libyaml loader, falling back to the pure python one when pyyaml was built without it
+try:
+  from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+  from yaml import SafeLoader as YAMLLoader
+
+
+Writeup = collections.namedtuple("Writeup", ["name", "dirpath", "ymlpath", "mtime", "size"])
+
+
+# dumping stays on the pure python emitter: libyaml folds long double-quoted scalars differently, which would change summary.yml
+class YAMLDumper(yaml.SafeDumper):
+  # summary dicts share objects (eg. tags lists); emit them inline instead of as &id001 anchors/*id001 aliases
+  def ignore_aliases(self, data):
+    return True
 
 
 def highlight(text, color="black", bold=False):
@@ -114,15 +129,35 @@ def mkdirp(path):
     else:
       raise
 
+def sorted_casefold(items):
+  # presort so entries differing only in case come out in the same order regardless of set iteration order
+  return sorted(sorted(items), key=str.casefold)
+
 def search_files(dirpath="./", regex="*"):
+  # prune excluded dirs before descending instead of walking them and filtering results afterwards
   matches = []
   for root, dirnames, filenames in os.walk(dirpath):
-    for filename in fnmatch.filter(filenames, regex):
-      resultfile = os.path.join(root, filename)
-      if os.path.exists(resultfile):
-        matches.append(resultfile)
-  fm = filter(lambda item: '/__pycache__'  not in item and '/results' not in item and '/.git' not in item and '/summary.yml' not in item and '/meta.yml' not in item and '/ttps.yml' not in item and '/test.ttp.yml' not in item, matches)
-  return list(set(fm))
+    dirnames[:] = sorted([x for x in dirnames if not x.startswith(("__pycache__", "results", ".git", ".svachal"))])
+    for filename in sorted(fnmatch.filter(filenames, regex)):
+      if filename.startswith(("results", ".git")) or filename in ["summary.yml", "meta.yml", "ttps.yml", "test.ttp.yml"]:
+        continue
+      matches.append(os.path.join(root, filename))
+  return matches
+
+def search_writeups(dirpath, ymlname="writeup.yml"):
+  # writeups live at <dirpath>/<name>/writeup.yml, so only direct subdirs are checked and nothing is walked
+  writeups = []
+  with os.scandir(dirpath) as entries:
+    for entry in entries:
+      if entry.name.startswith((".", "__pycache__", "results")) or not entry.is_dir():
+        continue
+      ymlpath = os.path.join(entry.path, ymlname)
+      try:
+        stat = os.stat(ymlpath)
+      except FileNotFoundError:
+        continue
+      writeups.append(Writeup(name=entry.name, dirpath=entry.path, ymlpath=ymlpath, mtime=stat.st_mtime_ns, size=stat.st_size))
+  return sorted(writeups, key=lambda x: x.name.casefold())
 
 def search_files_all(dirpath):
   return search_files(dirpath, regex="*")
@@ -134,16 +169,67 @@ def search_files_md(dirpath):
   return search_files(dirpath, regex="*.md")
 
 def download_json(url):
-  with urllib.request.urlopen(url) as url:
-    return json.loads(url.read().decode())
+  res = http_get(url)
+  res.raise_for_status()
+  return res.json()
 
 def load_json(filename):
   with open(filename) as fp:
     return json.load(fp)
 
 def save_json(datadict, filename):
-  with open(filename, "w", encoding="utf-8") as fp:
-    json.dump(datadict, fp, ensure_ascii=False, indent=2, sort_keys=True)
+  # write to a temp file in the same dir and rename it over the target, so an interrupted run never leaves a truncated file
+  dirname = os.path.dirname(os.path.abspath(filename))
+  fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".%s." % (os.path.basename(filename)), suffix=".tmp")
+  try:
+    with os.fdopen(fd, "w", encoding="utf-8") as fp:
+      json.dump(datadict, fp, ensure_ascii=False, indent=2, sort_keys=True)
+    os.chmod(tmpname, os.stat(filename).st_mode & 0o777 if os.path.exists(filename) else 0o644)
+    os.replace(tmpname, filename)
+  except:
+    if os.path.exists(tmpname):
+      os.remove(tmpname)
+    raise
+
+def save_json_cache(datadict, filename, cachefile, slim=None, tag=""):
+  # marshalled (and optionally slimmed down) copy of a json file, stamped with the source size/mtime it was built from
+  import marshal
+  stat = os.stat(filename)
+  if slim:
+    datadict = slim(datadict)
+  dirname = os.path.dirname(os.path.abspath(cachefile))
+  mkdirp(dirname)
+  fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".%s." % (os.path.basename(cachefile)), suffix=".tmp")
+  try:
+    with os.fdopen(fd, "wb") as fp:
+      fp.write(("%s\n" % (json.dumps([marshal.version, stat.st_size, stat.st_mtime_ns, tag]))).encode("utf-8"))
+      fp.write(marshal.dumps(datadict))
+    os.replace(tmpname, cachefile)
+  except:
+    if os.path.exists(tmpname):
+      os.remove(tmpname)
+    raise
+  return datadict
+
+def load_json_cache(filename, cachefile, slim=None, tag=""):
+  # the cache is only used while its stamp still matches the source file, otherwise the json is parsed and the cache rebuilt
+  import gc
+  import marshal
+  stat = os.stat(filename)
+  try:
+    with open(cachefile, "rb") as fp:
+      if json.loads(fp.readline()) == [marshal.version, stat.st_size, stat.st_mtime_ns, tag]:
+        # nothing loaded here can form reference cycles, skip the collector passes triggered by the many new dicts
+        gcenabled = gc.isenabled()
+        gc.disable()
+        try:
+          return marshal.loads(fp.read())
+        finally:
+          if gcenabled:
+            gc.enable()
+  except:
+    pass
+  return save_json_cache(load_json(filename), filename, cachefile, slim=slim, tag=tag)
 
 def load_file(filename):
   lines = []
@@ -156,15 +242,19 @@ def save_file(datalist, filename):
     fp.write("\n".join(sorted(list(set(list(list(filter(None, datalist))))))))
     fp.write("\n")
 
+def yaml_backend():
+  return "libyaml" if YAMLLoader.__name__.startswith("C") else "python"
+
 def load_yaml(filename):
-  return yaml.safe_load(open(filename))
+  with open(filename) as fp:
+    return yaml.load(fp, Loader=YAMLLoader)
 
 def save_yaml(datayml, filename):
   with open(filename, "w") as fp:
     yaml.dump(datayml, fp, default_flow_style=True)
 
 def dict2yaml(datadict):
-  return yaml.safe_dump(yaml.load(json.dumps(datadict), Loader=yaml.FullLoader), default_flow_style=False)
+  return yaml.dump(datadict, Dumper=YAMLDumper, default_flow_style=False)
 
 def file_open(filename):
   if filename and filename != "":
@@ -185,32 +275,186 @@ def file_save(filename, data, mode="w"):
         except:
           fo.write(data.encode('utf-16', 'surrogatepass').decode('utf-16'))
 
+def file_sha256(filename):
+  if not os.path.isfile(filename):
+    return None
+  digest = hashlib.sha256()
+  with open(filename, "rb") as fp:
+    for chunk in iter(lambda: fp.read(1 << 20), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+def md_frontmatter(text):
+  # yaml metadata block at the top of a pandoc markdown file
+  if not text.startswith("---\n"):
+    return {}
+  end = text.find("\n---\n", 4)
+  if end == -1:
+    return {}
+  try:
+    return yaml.load(text[4:end], Loader=YAMLLoader) or {}
+  except:
+    return {}
+
+def tex_dump_point(lines, stops):
+  # index of the first preamble line that cannot go into a precompiled format, moved back to the start of
+  # the enclosing \if...\fi or {...} block so that the dump never splits a conditional or a group
+  depth, lastzero = 0, 0
+  for idx, line in enumerate(lines):
+    if depth == 0:
+      lastzero = idx
+    stripped = line.strip()
+    if stripped.startswith("\\begin{document}") or any(stop.search(stripped) for stop in stops):
+      return lastzero
+    code = re.sub(r"(?<!\\)%.*$", "", re.sub(r"\\newif\\[a-zA-Z@]+", "", line))
+    code = code.replace("\\{", "").replace("\\}", "")
+    depth += len(re.findall(r"\\if(?!thenelse)[a-zA-Z@]*", code)) - len(re.findall(r"\\fi(?![a-zA-Z@])", code))
+    depth += code.count("{") - code.count("}")
+    depth = max(depth, 0)
+  return lastzero if depth else len(lines)
+
+def file_refs(data):
+  # collect relative file references (./screenshot00.png, ./infocard.png, ...) from a parsed writeup
+  refs = []
+  if isinstance(data, dict):
+    for value in data.values():
+      refs.extend(file_refs(value))
+  elif isinstance(data, list):
+    for item in data:
+      refs.extend(file_refs(item))
+  elif isinstance(data, str) and data.startswith("./"):
+    refs.append(data.strip())
+  return refs
+
+# shared http client state: one pooled session with timeouts/retries and an optional on-disk cache
+# that revalidates stored responses with If-None-Match/If-Modified-Since
+HTTP = {
+  "session": None,
+  "timeout": (5, 30),
+  "retries": 3,
+  "backoff": 0.5,
+  "cachedir": None,
+  "cachesize": 64*1024*1024,
+}
+
+def http_configure(timeout=None, retries=None, backoff=None, cachedir=None, cachesize=None):
+  if timeout is not None:
+    HTTP["timeout"] = timeout
+  if retries is not None or backoff is not None:
+    HTTP["retries"] = HTTP["retries"] if retries is None else retries
+    HTTP["backoff"] = HTTP["backoff"] if backoff is None else backoff
+    if HTTP["session"]:
+      HTTP["session"].close()
+    HTTP["session"] = None
+  if cachedir is not None:
+    HTTP["cachedir"] = cachedir if cachedir else None
+  if cachesize is not None:
+    HTTP["cachesize"] = cachesize
+
+def http_session():
+  if HTTP["session"] is None:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    # only idempotent requests are retried, on connection errors and transient server responses
+    retry = Retry(total=HTTP["retries"], backoff_factor=HTTP["backoff"], status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET", "HEAD"], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    HTTP["session"] = session
+  return HTTP["session"]
+
+def http_cache_paths(url, headers):
+  key = hashlib.sha256(("%s\n%s" % (url, json.dumps(headers, sort_keys=True))).encode("utf-8")).hexdigest()
+  return "%s/%s.json" % (HTTP["cachedir"], key), "%s/%s.body" % (HTTP["cachedir"], key)
+
+def http_cache_evict():
+  # least recently used entries go first, hits touch the body file so mtime tracks last use
+  entries, total = [], 0
+  with os.scandir(HTTP["cachedir"]) as it:
+    for entry in it:
+      if entry.name.endswith(".body"):
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+  for mtime, size, path in sorted(entries):
+    if total <= HTTP["cachesize"]:
+      break
+    for filename in [path, "%s.json" % (path[:-len(".body")])]:
+      if os.path.exists(filename):
+        os.remove(filename)
+    total -= size
+
+def http_get(url, headers={}, cache=True):
+  headers = dict(headers)
+  metafile, bodyfile, meta = None, None, None
+  if cache and HTTP["cachedir"]:
+    metafile, bodyfile = http_cache_paths(url, headers)
+    if os.path.isfile(metafile) and os.path.isfile(bodyfile):
+      try:
+        meta = load_json(metafile)
+      except:
+        meta = None
+    if meta and meta.get("etag"):
+      headers["If-None-Match"] = meta["etag"]
+    if meta and meta.get("lastmodified"):
+      headers["If-Modified-Since"] = meta["lastmodified"]
+
+  res = http_session().get(url, headers=headers, timeout=HTTP["timeout"])
+  if meta and res.status_code == 304:
+    with open(bodyfile, "rb") as fp:
+      res._content = fp.read()
+    res.status_code = meta["status"]
+    res.headers.update(meta["headers"])
+    res.from_cache = True
+    os.utime(bodyfile)
+    return res
+
+  res.from_cache = False
+  if metafile and res.status_code == 200 and (res.headers.get("ETag") or res.headers.get("Last-Modified")):
+    mkdirp(HTTP["cachedir"])
+    with open(bodyfile, "wb") as fp:
+      fp.write(res.content)
+    save_json({
+      "url": url,
+      "status": res.status_code,
+      "etag": res.headers.get("ETag"),
+      "lastmodified": res.headers.get("Last-Modified"),
+      "headers": {k: v for k, v in res.headers.items() if k.lower() in ["content-type", "etag", "last-modified"]},
+    }, metafile)
+    http_cache_evict()
+  return res
+
 def download(url, filename):
-  res = requests.get(url)
+  res = http_get(url)
   if res.status_code == 200:
-    open(filename, "wb").write(res.content)
+    with open(filename, "wb") as fp:
+      fp.write(res.content)
 
 def get_http_res(url, headers={}, requoteuri=False):
   if requoteuri:
-    return requests.get(cleanup_url(requests.utils.requote_uri(url)), headers=headers)
+    import requests
+    return http_get(cleanup_url(requests.utils.requote_uri(url)), headers=headers)
   else:
-    return requests.get(cleanup_url(url), headers=headers)
+    return http_get(cleanup_url(url), headers=headers)
 
 def get_http(url, headers={}):
-  res = requests.get(cleanup_url(url), headers=headers)
+  res = http_get(cleanup_url(url), headers=headers)
   if res.status_code == 200:
     return res.json()
   else:
     return {}
 
 def post_http(url, data={}, headers={}):
-  res = requests.post(cleanup_url(url), data=json.dumps(data), headers=headers)
+  res = http_session().post(cleanup_url(url), data=json.dumps(data), headers=headers, timeout=HTTP["timeout"])
   if res.status_code == 200:
     return res.json()
   else:
     return {}
 
 def strip_html(data):
+  from bs4 import BeautifulSoup
   return re.sub("\s+", " ", BeautifulSoup(data, "lxml").text)
 
 def datetimefilter(datestr, format='%Y/%m/%d %H:%M:%S'):
@@ -293,6 +537,34 @@ def monojoin(items):
 def customsort(items):
   return [str(y) for y in sorted([int(x) for x in items])]
 
+def parse_protokey(protokey):
+  # writeup ttps are keyed as port/l4[/proto[/service]]
+  parts = protokey.split("/", 3)
+  if len(parts) < 2:
+    raise ValueError("invalid ttps key '%s', expected port/l4[/proto[/service]]" % (protokey))
+  return tuple(parts + [None] * (4 - len(parts)))
+
+def get_jinja_filters():
+  return {
+    "datetimefilter": datetimefilter,
+    "ghsearchlinks": ghsearchlinks,
+    "anchorformat": anchorformat,
+    "anchorformatttps": anchorformatttps,
+    "mdurl": mdurl,
+    "obfuscate": obfuscate,
+    "monojoin": monojoin,
+    "customsort": customsort,
+  }
+
+def get_jinja_filters_version():
+  # filters are versioned by their source so any change to them invalidates rendered output
+  import inspect
+  digest = hashlib.sha256()
+  for name, func in sorted(get_jinja_filters().items()):
+    digest.update(name.encode("utf-8"))
+    digest.update(inspect.getsource(func).encode("utf-8"))
+  return digest.hexdigest()
+
 def lookahead(iterable):
   # https://stackoverflow.com/a/1630350
   it = iter(iterable)
@@ -317,6 +589,7 @@ def yturl2verboseid(url):
     return url
 
 def sparkify(difficulty):
+  import sparkline
   return sparkline.sparkify(difficulty)
 
 def to_color_difficulty(sparkline):
@@ -372,58 +645,106 @@ def to_emoji(text):
   else:
     return ""
 
-def to_markdown_table(pt):
-  _junc = pt.junction_char
-  if _junc != "|":
-    pt.junction_char = "|"
-  markdown = [row for row in pt.get_string().split("\n")[1:-1]]
-  pt.junction_char = _junc
-  return "\n".join(markdown)
+RE_ANSI = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
 
-def get_table(header, rows, delim="___", aligndict=None, markdown=False, colalign=None, multiline=False):
-  table = prettytable.PrettyTable()
-  table.field_names = header
-  table.align = "c"; table.valign = "m"
+def text_width(text):
+  # terminal cell width of a single line: ansi color codes take no space, east asian wide chars and emoji take two
+  if text.isascii() and "\x1b" not in text:
+    return len(text)
+  try:
+    import wcwidth
+    if hasattr(wcwidth, "width"):
+      return wcwidth.width(text)
+    # wcwidth releases before width() only have wcswidth, which neither strips ansi codes nor measures control chars (-1)
+    width = wcwidth.wcswidth(RE_ANSI.sub("", text))
+    if width >= 0:
+      return width
+  except ImportError:
+    pass
+  import unicodedata
+  width, prev = 0, None
+  for char in RE_ANSI.sub("", text):
+    if char == "\ufe0f" and prev and unicodedata.east_asian_width(prev) not in ["W", "F"]:
+      width += 1
+    elif unicodedata.combining(char) or unicodedata.category(char) in ["Mn", "Me", "Cf"]:
+      pass
+    else:
+      width += 2 if unicodedata.east_asian_width(char) in ["W", "F"] else 1
+    prev = char
+  return width
+
+def justify(text, width, align="c"):
+  # same padding rules as str.ljust/rjust/center, but on display width instead of len()
+  margin = width - text_width(text)
+  if margin <= 0:
+    return text
+  if align == "l":
+    return text + " "*margin
+  elif align == "r":
+    return " "*margin + text
+  left = margin//2 + (margin & width & 1)
+  return " "*left + text + " "*(margin - left)
+
+TABLE_ALIGN = {"#": "r", "ID": "r", "Name": "l", "Expires": "l", "Match": "l", "Follow": "l", "Private": "c", "Rating": "c", "Difficulty": "c", "OS": "c", "OSCPlike": "c", "Owned": "c", "Writeup": "c", "TTPs": "c"}
+
+def write_table(fp, header, rows, aligndict=None, markdown=False, colalign=None, multiline=False):
+  # rows are sequences of cells (a cell may span several lines), column widths are computed in one pass over them
+  header = [str(x) for x in header]
+  cells, widths = [], [text_width(x) for x in header]
   for row in rows:
-    table.add_row(row.split(delim))
+    row = [str(x).split("\n") for x in row]
+    if len(row) != len(header):
+      raise ValueError("row has %d cells, expected %d: %s" % (len(row), len(header), row))
+    for idx, lines in enumerate(row):
+      widths[idx] = max([widths[idx]] + [text_width(x) for x in lines])
+    cells.append(row)
+
   if markdown:
-    if colalign in ["left", "center", "right"]:
-      if colalign == "left":
-        return to_markdown_table(table).replace("|-", "|:")
-      elif colalign == "center":
-        return to_markdown_table(table).replace("-|-", ":|:").replace("|-", "|:").replace("-|", ":|")
-      elif colalign == "right":
-        return to_markdown_table(table).replace("-|", ":|")
-    else:
-      #return table.get_html_string()
-      return to_markdown_table(table)
+    aligns = ["c"]*len(header)
+    vertical, junction = "|", "|"
+    ends = {"left": (":", "-"), "center": (":", ":"), "right": ("-", ":")}.get(colalign, ("-", "-"))
+    rule = "|%s|" % ("|".join("%s%s%s" % (ends[0], "-"*width, ends[1]) for width in widths))
   else:
-    if aligndict:
-      for colheader in aligndict:
-        table.align[colheader] = aligndict[colheader]
-    else:
-      table.align["#"] = "r"
-      table.align["ID"] = "r"
-      table.align["Name"] = "l"
-      table.align["Expires"] = "l"
-      table.align["Match"] = "l"
-      table.align["Follow"] = "l"
-      table.align["Private"] = "c"
-      table.align["Rating"] = "c"
-      table.align["Difficulty"] = "c"
-      table.align["OS"] = "c"
-      table.align["OSCPlike"] = "c"
-      table.align["Owned"] = "c"
-      table.align["Writeup"] = "c"
-      table.align["TTPs"] = "c"
-    table.vertical_char = " "
-    table.horizontal_char = "-"
-    table.junction_char = " "
-    table.hrules = prettytable.ALL if multiline else prettytable.FRAME
-    return "\n%s\n" % (table.get_string())
+    aligns = [(aligndict if aligndict else TABLE_ALIGN).get(x, "c") for x in header]
+    vertical, junction = " ", " "
+    rule = "%s%s%s" % (junction, junction.join("-"*(width+2) for width in widths), junction)
+
+  def emit(lines):
+    height = max(len(x) for x in lines)
+    for y in range(height):
+      parts = []
+      for idx, cell in enumerate(lines):
+        # vertically center shorter cells, extra blank line goes below
+        top = (height - len(cell))//2
+        line = cell[y - top] if 0 <= y - top < len(cell) else ""
+        parts.append(" %s " % (justify(line, widths[idx], aligns[idx])))
+      fp.write("%s%s%s\n" % (vertical, vertical.join(parts), vertical))
+
+  if not markdown:
+    fp.write("%s\n" % (rule))
+  emit([[x] for x in header])
+  fp.write("%s\n" % (rule))
+  for idx, row in enumerate(cells):
+    emit(row)
+    if not markdown and (multiline or idx == len(cells)-1):
+      fp.write("%s\n" % (rule))
+  if not markdown and not multiline and not cells:
+    fp.write("%s\n" % (rule))
+
+def get_table(header, rows, delim="___", aligndict=None, markdown=False, colalign=None, multiline=False):
+  import io
+  out = io.StringIO()
+  write_table(out, header, [row.split(delim) if isinstance(row, str) else row for row in rows], aligndict=aligndict, markdown=markdown, colalign=colalign, multiline=multiline)
+  table = out.getvalue()[:-1]
+  return table if markdown else "\n%s\n" % (table)
 
 def to_table(header, rows, delim="___", aligndict=None, markdown=False, multiline=False):
-  print(get_table(header, rows, delim=delim, aligndict=aligndict, markdown=markdown, multiline=multiline))
+  import sys
+  if not markdown:
+    sys.stdout.write("\n")
+  write_table(sys.stdout, header, [row.split(delim) if isinstance(row, str) else row for row in rows], aligndict=aligndict, markdown=markdown, multiline=multiline)
+  if not markdown:
+    sys.stdout.write("\n")
 
 def to_json(data):
   print(json.dumps(data, indent=2, sort_keys=True))
@@ -611,13 +932,57 @@ def show_machines(data, sort_key="name", jsonify=False, gsheet=False, showttps=F
 
     to_table(header=header, rows=rows, delim="___", aligndict=None, markdown=False, multiline=False)
 
-def to_xkcd(plotdict, filename, title, rotate=True, trimlength=20):
+def png_text(filename):
+  # read tEXt/iTXt metadata chunks from a png without decoding the image
+  metadata = {}
+  if not os.path.isfile(filename):
+    return metadata
+  with open(filename, "rb") as fp:
+    if fp.read(8) != b"\x89PNG\r\n\x1a\n":
+      return metadata
+    while True:
+      header = fp.read(8)
+      if len(header) < 8:
+        break
+      length, chunktype = int.from_bytes(header[:4], "big"), header[4:]
+      if chunktype == b"IDAT" or chunktype == b"IEND":
+        break
+      data = fp.read(length)
+      fp.read(4)
+      if chunktype == b"tEXt" and b"\x00" in data:
+        key, value = data.split(b"\x00", 1)
+        metadata[key.decode("latin-1")] = value.decode("latin-1")
+      elif chunktype == b"iTXt" and b"\x00" in data:
+        key, rest = data.split(b"\x00", 1)
+        if rest[:1] == b"\x00":
+          metadata[key.decode("utf-8")] = rest[2:].split(b"\x00", 2)[-1].decode("utf-8")
+  return metadata
+
+def chart_hash(chartfunc, **kwargs):
+  # identifies a chart by its inputs and the source of the function drawing it
+  import inspect
+  digest = hashlib.sha256()
+  digest.update(inspect.getsource(chartfunc).encode("utf-8"))
+  digest.update(json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8"))
+  return digest.hexdigest()
+
+def to_xkcd(plotdict, filename, title, rotate=True, trimlength=20, dpi=300, force=False):
+  # charts are tagged with a hash of their inputs and only redrawn when it changes; returns True if the png was (re)written
+  charthash = chart_hash(to_xkcd, plotdict=list(plotdict.items()), title=title, rotate=rotate, trimlength=trimlength, dpi=dpi)
+  if not force and png_text(filename).get("svachal") == charthash:
+    return False
+  import matplotlib.pyplot as plt
+  from matplotlib.figure import Figure
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
   datadict = {}
   for key in plotdict:
     datadict[key] = [[key], [plotdict[key]]]
   with plt.xkcd():
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
     for idx, label in enumerate(datadict):
-      plt.bar(datadict[label][0], datadict[label][1])
+      ax.bar(datadict[label][0], datadict[label][1])
       text = "%s... (%d)" % ("".join(datadict[label][0][0][:trimlength]), datadict[label][1][0]) if len(label) >= trimlength else "%s (%d)" % (datadict[label][0][0], datadict[label][1][0])
       if rotate:
         angle = 90
@@ -626,29 +991,75 @@ def to_xkcd(plotdict, filename, title, rotate=True, trimlength=20):
         angle = 0
         padding = (len(label)/2)/10
         x, y = idx-padding, datadict[label][1][0]-1
-      plt.text(s=text, x=x, y=y, color="black", verticalalignment="center", horizontalalignment="left", size=15, rotation=angle, rotation_mode="anchor")
-    plt.suptitle(title, fontsize=18, color="black")
-    plt.gca().spines["left"].set_color("black")
-    plt.gca().spines["bottom"].set_color("black")
-    plt.gca().spines["left"].set_visible(False)
-    plt.gca().spines["right"].set_visible(False)
-    plt.gca().spines["top"].set_visible(False)
-    plt.xticks([]); plt.yticks([])
-    plt.tight_layout()
-    plt.savefig(filename, dpi=300)
-    plt.close()
+      ax.text(s=text, x=x, y=y, color="black", verticalalignment="center", horizontalalignment="left", size=15, rotation=angle, rotation_mode="anchor")
+    fig.suptitle(title, fontsize=18, color="black")
+    ax.spines["left"].set_color("black")
+    ax.spines["bottom"].set_color("black")
+    ax.spines["left"].set_visible(False)
+    ax.spines["right"].set_visible(False)
+    ax.spines["top"].set_visible(False)
+    ax.set_xticks([]); ax.set_yticks([])
+    fig.tight_layout()
+    fig.savefig(filename, dpi=dpi, metadata={"svachal": charthash})
+  return True
+
+def to_radar(aggregate, maker, filename, machineid=None, cachedir=None, force=False):
+  # local replacement for the quickchart.io radar (same labels/colors as the old chart.js spec); charts are
+  # tagged with a hash of machine id + matrix values and shared between writeups through cachedir
+  charthash = chart_hash(to_radar, machineid=machineid, aggregate=aggregate, maker=maker)
+  if not force and png_text(filename).get("svachal") == charthash:
+    return False
+  cachefile = "%s/%s.png" % (cachedir, charthash) if cachedir else None
+  if not force and cachefile and os.path.isfile(cachefile):
+    import shutil
+    shutil.copyfile(cachefile, filename)
+    return True
+  import math
+  from matplotlib.figure import Figure
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
+  labels = ["Enumeration", "Real-Life", "CVE", "Custom\nExploitation", "CTF-Like"]
+  datasets = [("User rated", aggregate, (154/255, 204/255, 20/255)), ("Maker rated", maker, (86/255, 192/255, 224/255))]
+  angles = [math.pi/2 - 2*math.pi*idx/len(labels) for idx in range(len(labels))]
+  rmax = max([10] + [float(x) for _, values, _ in datasets for x in values])
+  fig = Figure(figsize=(2.7, 2.0), dpi=200)
+  FigureCanvasAgg(fig)
+  fig.patch.set_facecolor((1, 1, 1, 0.2))
+  ax = fig.add_axes([0.2, 0.14, 0.6, 0.72], polar=True)
+  ax.set_facecolor((0, 0, 0, 0))
+  ax.set_ylim(0, rmax)
+  ax.set_yticks([]); ax.set_xticks([])
+  ax.grid(False)
+  ax.spines["polar"].set_visible(False)
+  for level in range(1, 6):
+    ax.plot(angles + angles[:1], [rmax*level/5]*(len(labels)+1), color=(51/255, 54/255, 60/255), linewidth=0.4)
+  for angle, label in zip(angles, labels):
+    ax.plot([angle, angle], [0, rmax], color=(21/255, 23/255, 25/255), linewidth=0.4)
+    ax.text(angle, rmax*1.22, label, fontsize=5, color=(0.4, 0.4, 0.4), ha="center", va="center")
+  for name, values, color in datasets:
+    values = [float(x) for x in values][:len(labels)]
+    ax.fill(angles[:len(values)] + angles[:1], values + values[:1], color=color + (0.2,), linewidth=0)
+    ax.plot(angles[:len(values)] + angles[:1], values + values[:1], color=color, linewidth=1, marker="o", markersize=1.5)
+  fig.savefig(filename, dpi=200, facecolor=fig.get_facecolor(), metadata={"svachal": charthash})
+  if cachefile:
+    import shutil
+    mkdirp(cachedir)
+    shutil.copyfile(filename, cachefile)
+  return True
 
 def to_sparklines(items, filename, transparent=True):
+  from matplotlib.figure import Figure
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
   colormap = ["#9acc14", "#9acc14", "#9acc14", "#f7af3e", "#f7af3e", "#f7af3e", "#f7af3e", "#db524b", "#db524b", "#db524b"]
-  barlist = plt.bar([str(x) for x in range(len(items))], items, width=0.95)
+  fig = Figure()
+  FigureCanvasAgg(fig)
+  ax = fig.add_subplot()
+  barlist = ax.bar([str(x) for x in range(len(items))], items, width=0.95)
   for i in range(len(items)):
     barlist[i].set_color(colormap[i])
-  ax = plt.gca()
   ax.spines["bottom"].set_visible(False)
   ax.spines["left"].set_visible(False)
   ax.spines["right"].set_visible(False)
   ax.spines["top"].set_visible(False)
-  plt.xticks([]); plt.yticks([])
-  plt.tight_layout()
-  plt.savefig(filename, dpi=300, transparent=transparent)
-  plt.close()
+  ax.set_xticks([]); ax.set_yticks([])
+  fig.tight_layout()
+  fig.savefig(filename, dpi=300, transparent=transparent)
@@ -1,10 +1,9 @@
 #!/usr/bin/env python3
 
 from __future__ import print_function
-from pprint import pprint
 import subprocess
 import hashlib
-import secrets
+import shutil
 import yaml
 import sys
 import re
@@ -35,18 +34,27 @@ rgb(244, 180, 187) #f4b4bb
 rgb(192, 45, 46)   #c02d2e 
 """
 
+RE_TOOLTIP = re.compile(r'^{{\s*(.*)\s*}}$', re.M)
+RE_LINK = re.compile(r'^\[\s*(.*)\s*\]\s*\(\s*(.*)\s*\)$', re.M)
+RE_LINK_TOOLTIP = re.compile(r'^\[\s*(.*)\s*\]\s*\(\s*(.*)\s*\)\s*{{\s*(.*)\s*}}$', re.M)
+RE_IMAGE = re.compile(r'^!\[\s*(.*)\s*\]\s*\(\s*(.*)\s*\)$', re.M)
+RE_IMAGE_TOOLTIP = re.compile(r'^!\[\s*(.*)\s*\]\s*\(\s*(.*)\s*\)\s*{{\s*(.*)\s*}}$', re.M)
+RE_PHASE = re.compile(r'^(_|\.{1,3}) (.*)$', re.S)
+
 
 class YML2DOT:
-  def __init__(self, rootnode="!@#$", fontsize="medium", addrootnode=True, rankdirlr=False, randomnodecolor=True, savehtml=False):
+  def __init__(self, rootnode="!@#$", fontsize="medium", addrootnode=True, rankdirlr=False, randomnodecolor=True, savehtml=False, colorseed=""):
     self.nodesdict = {}
     self.nodes = []
     self.edges = []
+    self.pending = []
     self.config = {
       "rootnode": rootnode,
       "fontsize": 18 if fontsize.strip().lower() == "large" else 16 if fontsize.strip().lower() == "medium" else 12,
       "rankdirlr": rankdirlr,
       "addrootnode": addrootnode,
       "randomnodecolor": randomnodecolor,
+      "colorseed": colorseed,
       "savehtml": savehtml,
       "ignorekeys": ["__metadata__"],
       "writeupyml": False,
@@ -84,6 +92,10 @@ class YML2DOT:
   def md5(self, data):
     return hashlib.md5(data.encode('utf-8')).hexdigest()
 
+  def nodecolor(self, label):
+    # palette slot derived from the label (and optional seed), so the same yml always gives the same colors
+    return self.config["colorpallete"][int(self.md5("%s%s" % (self.config["colorseed"], label)), 16) % len(self.config["colorpallete"])]
+
   def get_edges(self, treedict, parent=None):
     if not parent and self.config["addrootnode"]:
       parent = self.config["rootnode"]
@@ -99,31 +111,36 @@ class YML2DOT:
     elif isinstance(treedict, str):
       self.update_nodes_edges(parent, treedict)
 
+  def parse_node(self, node):
+    # returns (label, href, tooltip, image) for plain, {{tooltip}}, [link](href) and ![image](path) nodes
+    label, href, tooltip, image = node, None, node, None
+    match = RE_TOOLTIP.match(node)
+    if match:
+      tooltip = match.groups()[0]
+      label = tooltip
+    match = RE_LINK.match(node)
+    if match:
+      label, href = match.groups()
+      tooltip = label
+    match = RE_LINK_TOOLTIP.match(node)
+    if match:
+      label, href, tooltip = match.groups()
+
+    match = RE_IMAGE.match(node)
+    if match:
+      label, image = match.groups()
+      tooltip = label
+    match = RE_IMAGE_TOOLTIP.match(node)
+    if match:
+      label, image, tooltip = match.groups()
+    return label, href, tooltip, image
+
   def update_nodes_edges(self, parent, child, indent=0, borderless=False):
     def update_nodes(node, spaces, indent, borderless):
       if node not in self.nodesdict:
-        label, href, tooltip, image = node, None, node, None
-        match = re.match(r'^{{\s*(.*)\s*}}$', node, re.M)
-        if match:
-          tooltip = match.groups()[0]
-          label = tooltip
-        match = re.match(r'^\[\s*(.*)\s*\]\s*\(\s*(.*)\s*\)$', node, re.M)
-        if match:
-          label, href = match.groups()
-          tooltip = label
-        match = re.match(r'^\[\s*(.*)\s*\]\s*\(\s*(.*)\s*\)\s*{{\s*(.*)\s*}}$', node, re.M)
-        if match:
-          label, href, tooltip = match.groups()
-
-        match = re.match(r'^!\[\s*(.*)\s*\]\s*\(\s*(.*)\s*\)$', node, re.M)
-        if match:
-          label, image = match.groups()
-          tooltip = label
-        match = re.match(r'^!\[\s*(.*)\s*\]\s*\(\s*(.*)\s*\)\s*{{\s*(.*)\s*}}$', node, re.M)
-        if match:
-          label, image, tooltip = match.groups()
-
-        nodecolor = secrets.choice(self.config["colorpallete"]) if self.config["randomnodecolor"] else self.config["colornode"]
+        label, href, tooltip, image = self.parse_node(node)
+
+        nodecolor = self.nodecolor(label) if self.config["randomnodecolor"] else self.config["colornode"]
         self.config["writeupyml"] = False
         bordercolor = self.config["colorborder"]
         if label.startswith("_ "):
@@ -190,7 +207,49 @@ class YML2DOT:
     if parent and child:
       self.edges.append("%s%d -> %d [color=\"%s\"];" % (spaces, self.nodesdict[parent]["nodeid"], self.nodesdict[child]["nodeid"], self.config["coloredge"]))
 
-  def process(self, ymldata, dotfile):
+  def pngfile(self, dotfile):
+    return "%s.png" % (".".join(dotfile.split(".")[:-1]))
+
+  def render(self, dotfiles):
+    # one dot process lays out all graphs; -O writes <dotfile>.png next to each input, which is renamed to <name>.png
+    if not dotfiles:
+      return []
+    dot = shutil.which("dot") or "/usr/bin/dot"
+    try:
+      results = subprocess.run([dot, "-Tpng", "-O"] + dotfiles, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as ex:
+      # graphviz missing or not executable: nothing in this batch can render, report it and let the caller carry on
+      print("dot failed to render %s: %s" % (", ".join(dotfiles), repr(ex)))
+      return []
+    rendered, failed = [], []
+    for dotfile in dotfiles:
+      if os.path.isfile("%s.png" % (dotfile)):
+        os.replace("%s.png" % (dotfile), self.pngfile(dotfile))
+        rendered.append(dotfile)
+      else:
+        failed.append(dotfile)
+    if results.returncode != 0 and len(dotfiles) > 1 and failed:
+      # a broken graph aborts the batch, retry the rest one by one so only the broken one is lost
+      for dotfile in failed:
+        rendered.extend(self.render([dotfile]))
+    elif failed:
+      print("dot failed to render %s: %s" % (", ".join(failed), results.stderr.decode("utf-8", "replace").strip()))
+    return rendered
+
+  def discard(self, dotfiles, rendered):
+    # process() takes an unchanged .dot next to a .png as already rendered, so a .dot whose png could not be
+    # rendered is removed and the graph is retried on the next run instead of keeping the stale png
+    for dotfile in sorted(set(dotfiles) - set(rendered)):
+      if os.path.isfile(dotfile):
+        os.remove(dotfile)
+
+  def flush(self):
+    rendered = self.render(self.pending)
+    self.discard(self.pending, rendered)
+    self.pending = []
+    return rendered
+
+  def process(self, ymldata, dotfile, render=True):
     ymlfile = dotfile.replace("dot", "yml")
 
     self.nodesdict = {}
@@ -217,8 +276,16 @@ class YML2DOT:
     dotgraph.append("  }")
     dotgraph.append("}")
     dotgraph.append("")
-    with open(dotfile, "w") as fp:
-      fp.write("\n".join(dotgraph))
+
+    # content addressed: an identical .dot next to an existing .png means this graph is already rendered
+    pngfile = self.pngfile(dotfile)
+    changed = True
+    if os.path.isfile(pngfile) and os.path.isfile(dotfile):
+      with open(dotfile) as fp:
+        changed = fp.read() != "\n".join(dotgraph)
+    if changed:
+      with open(dotfile, "w") as fp:
+        fp.write("\n".join(dotgraph))
 
     if self.config["savehtml"]:
       d3graph = []
@@ -238,26 +305,122 @@ class YML2DOT:
       with open(htmlfile, "w") as fp:
         fp.write("\n".join(d3graph))
 
-    pngfile = "%s.png" % (".".join(dotfile.split(".")[:-1]))
-    subprocess.call("/usr/bin/dot -Tpng %s -o %s" % (dotfile, pngfile), shell=True)
+    if changed:
+      if render:
+        self.discard([dotfile], self.render([dotfile]))
+      else:
+        self.pending.append(dotfile)
 
     return dotgraph
 
 
+class AttackGraph(YML2DOT):
+  # merges many killchains into one graph: nodes are (phase, technique/service) pairs with integer ids,
+  # edge weights count the writeups sharing a transition
+  def __init__(self, fontsize="medium", rankdirlr=True):
+    super().__init__(fontsize=fontsize, addrootnode=False, rankdirlr=rankdirlr, randomnodecolor=False)
+    self.phases = {"_": "cluster0", ".": "cluster1", "..": "cluster2", "...": "cluster3"}
+    self.nodeids = {}
+    self.nodelabels = []
+    self.nodephases = []
+    self.nodeweights = []
+    self.edgeweights = {}
+    self.writeups = 0
+
+  def nodeid(self, node, parentphase):
+    label = self.parse_node(str(node).strip())[0].strip()
+    match = RE_PHASE.match(label)
+    if match:
+      phase, label = self.phases[match.groups()[0]], match.groups()[1].strip()
+    else:
+      phase = parentphase
+    if phase == "cluster0":
+      # writeup root nodes name the machine, all of them collapse into one target node
+      label = "target"
+    key = (phase, label.casefold())
+    if key not in self.nodeids:
+      self.nodeids[key] = len(self.nodelabels)
+      self.nodelabels.append(label)
+      self.nodephases.append(phase)
+      self.nodeweights.append(0)
+    return self.nodeids[key]
+
+  def walk(self, treedict, parent, parentphase, nodes, edges):
+    if isinstance(treedict, dict):
+      for key in treedict:
+        if key in self.config["ignorekeys"]:
+          continue
+        child = self.nodeid(key, parentphase)
+        nodes.add(child)
+        if parent is not None and parent != child:
+          edges.add((parent, child))
+        self.walk(treedict[key], child, self.nodephases[child], nodes, edges)
+    elif isinstance(treedict, list):
+      for item in treedict:
+        self.walk(item, parent, parentphase, nodes, edges)
+    elif isinstance(treedict, str):
+      child = self.nodeid(treedict, parentphase)
+      nodes.add(child)
+      if parent is not None and parent != child:
+        edges.add((parent, child))
+
+  def add(self, killchain):
+    # nodes/edges are collected per writeup first so a transition repeated within one killchain counts once
+    nodes, edges = set(), set()
+    self.walk(killchain, None, None, nodes, edges)
+    for node in nodes:
+      self.nodeweights[node] += 1
+    for edge in edges:
+      self.edgeweights[edge] = self.edgeweights.get(edge, 0) + 1
+    self.writeups += 1
+
+  def to_dot(self, minweight=1, title="attack graph"):
+    edges = sorted((edge for edge, weight in self.edgeweights.items() if weight >= minweight), key=lambda e: (-self.edgeweights[e], e))
+    nodes = sorted(set([x for edge in edges for x in edge]))
+    maxweight = max([self.edgeweights[x] for x in edges] or [1])
+
+    dotgraph = []
+    dotgraph.append("digraph G {")
+    dotgraph.append("  rankdir=LR;" if self.config["rankdirlr"] else "  #rankdir=LR;")
+    dotgraph.append("  splines=\"spline\"; overlap=scale; resolution=72; bgcolor=\"%s\"; outputorder=\"edgesfirst\";" % (self.config["colorbg"]))
+    dotgraph.append("  node [fontname=\"courier\" fontsize=%s shape=box width=0.25 style=\"filled,solid\"];" % (self.config["fontsize"]))
+    dotgraph.append("  edge [style=solid color=\"%s\" arrowhead=vee arrowsize=0.75 fontname=\"courier\" fontsize=%d];" % (self.config["coloredge"], max(self.config["fontsize"]-4, 8)))
+    dotgraph.append("  label=\"%s (writeups: %d, nodes: %d, edges: %d, min weight: %d)\";" % (title, self.writeups, len(nodes), len(edges), minweight))
+    dotgraph.append("")
+    for node in nodes:
+      cluster = self.config[self.nodephases[node]] if self.nodephases[node] else {"title": "", "colornode": self.config["colornode"], "colorborder": self.config["colorborder"]}
+      label = self.nodelabels[node].replace("\\", "\\\\").replace("\"", "\\\"")
+      dotgraph.append("  %d[label=\"%s\" color=\"%s\" fillcolor=\"%s\" tooltip=\"%s (%d writeups)\"];" % (node, label, cluster["colorborder"], cluster["colornode"], label, self.nodeweights[node]))
+    dotgraph.append("")
+    for src, dst in edges:
+      weight = self.edgeweights[(src, dst)]
+      dotgraph.append("  %d -> %d [label=\"%d\" penwidth=%.2f];" % (src, dst, weight, 0.75 + 4.25 * weight / maxweight))
+    dotgraph.append("}")
+    dotgraph.append("")
+    return "\n".join(dotgraph)
+
+  def save(self, dotfile, minweight=1, title="attack graph", render=True):
+    with open(dotfile, "w") as fp:
+      fp.write(self.to_dot(minweight=minweight, title=title))
+    if render:
+      self.render([dotfile])
+    return self.pngfile(dotfile)
+
+
 if __name__ == "__main__":
-  if len(sys.argv) != 2:
-    print("USAGE: %s <filename>" % (sys.argv[0]))
+  if len(sys.argv) not in [2, 3]:
+    print("USAGE: %s <filename> [colorseed]" % (sys.argv[0]))
     sys.exit(1)
 
-  if not os.path.exists(sys.argv[-1]):
-    print("no such file: %s" % (sys.argv[-1]))
+  if not os.path.exists(sys.argv[1]):
+    print("no such file: %s" % (sys.argv[1]))
     sys.exit(2)
 
-  infilename = sys.argv[-1]
+  infilename = sys.argv[1]
   outfileprefix = ".".join(infilename.split(".")[:-1])
 
   with open(infilename) as fp:
     ymldata = yaml.safe_load(fp)
 
-  y2d = YML2DOT(rootnode="!@#$", fontsize="medium", addrootnode=False, rankdirlr=False, randomnodecolor=True, savehtml=True)
-  y2d.process(ymldata, outfileprefix)
+  y2d = YML2DOT(rootnode="!@#$", fontsize="medium", addrootnode=False, rankdirlr=False, randomnodecolor=True, savehtml=True, colorseed=sys.argv[2] if len(sys.argv) == 3 else "")
+  y2d.process(ymldata, "%s.dot" % (outfileprefix))